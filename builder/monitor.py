@@ -1,34 +1,163 @@
 """monitor redis for tasks to execute"""
 
 import json
+import re
+import shutil
 import subprocess
 import os
+import socket
+import threading
+import time
 
-from datetime import datetime
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import redis
 
 
+class RedisPool:
+    """one shared redis connection pool per process"""
+
+    MAX_CONNECTIONS = 16
+    HEALTH_CHECK_INTERVAL = 30
+
+    _pool = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, host, port):
+        """return shared pool"""
+        with cls._lock:
+            if not cls._pool:
+                cls._pool = redis.BlockingConnectionPool(
+                    host=host,
+                    port=port,
+                    max_connections=cls.MAX_CONNECTIONS,
+                    socket_keepalive=True,
+                    health_check_interval=cls.HEALTH_CHECK_INTERVAL,
+                )
+
+        return cls._pool
+
+
 class RedisBase:
     """connection base for redis"""
 
     REDIS_HOST = "localhost"
     REDIS_PORT = 6379
     NAME_SPACE = "ta:"
-    TASK_KEY = NAME_SPACE + "task:buildx"
+    STREAM = NAME_SPACE + "task:stream"
+    LATEST = NAME_SPACE + "task:latest"
+    STATS = NAME_SPACE + "task:stats"
+    FAILED = NAME_SPACE + "task:failed"
+    GROUP = "builder"
+    CONSUMER = os.environ.get("BUILDER_NAME", socket.gethostname())
 
     def __init__(self):
-        self.conn = redis.Redis(host=self.REDIS_HOST, port=self.REDIS_PORT)
+        self.conn = redis.Redis(
+            connection_pool=RedisPool.get(self.REDIS_HOST, self.REDIS_PORT)
+        )
+
+    def pipeline(self, transaction=False):
+        """batch multiple commands into one round trip"""
+        return self.conn.pipeline(transaction=transaction)
+
+
+class BuildRecord(RedisBase):
+    """structured state, timings and log of a task, published on change"""
+
+    KEY = RedisBase.NAME_SPACE + "build:"
+    RECENT = RedisBase.NAME_SPACE + "builds"
+    EVENTS = RedisBase.NAME_SPACE + "build:events"
+    LOG = RedisBase.NAME_SPACE + "build:log:"
+    TTL = 30 * 24 * 60 * 60
+    RECENT_MAX = 200
+    LOG_MAXLEN = 2000
+
+    def __init__(self, entry_id):
+        super().__init__()
+        self.entry_id = entry_id
+        self.key = self.KEY + entry_id
+        self.requested = int(entry_id.split("-")[0]) / 1000
+
+    def create(self, task):
+        """add queued task to recent builds"""
+        pipe = self.pipeline(transaction=True)
+        pipe.hset(self.key, mapping={
+            "repo": task["name"],
+            "task_name": task["task_name"],
+            "commit": task.get("commit") or "",
+            "requested": self.requested,
+        })
+        pipe.zadd(self.RECENT, {self.entry_id: self.requested})
+        pipe.zremrangebyrank(self.RECENT, 0, -self.RECENT_MAX - 1)
+        pipe.execute()
+        self.set_state("queued")
+
+    def set_state(self, state, **fields):
+        """store state transition and publish it"""
+        now = time.time()
+        fields.update({"state": state, f"{state}_at": now})
+        event = {"entry_id": self.entry_id, **fields}
+        pipe = self.pipeline(transaction=True)
+        pipe.hset(self.key, mapping=fields)
+        pipe.expire(self.key, self.TTL)
+        pipe.publish(self.EVENTS, json.dumps(event))
+        pipe.execute()
+
+    def set_fields(self, fields):
+        """store timings and metrics"""
+        pipe = self.pipeline(transaction=True)
+        pipe.hset(self.key, mapping=fields)
+        pipe.expire(self.key, self.TTL)
+        pipe.execute()
+
+    def add_attempt(self):
+        """count attempt, return attempt number"""
+        return self.conn.hincrby(self.key, "attempts", 1)
+
+    def get_done(self):
+        """get ids of steps completed in earlier attempts"""
+        return {i.decode() for i in self.conn.smembers(self.key + ":done")}
+
+    def mark_done(self, step_id):
+        """checkpoint completed step"""
+        pipe = self.pipeline(transaction=True)
+        pipe.sadd(self.key + ":done", step_id)
+        pipe.expire(self.key + ":done", self.TTL)
+        pipe.execute()
+
+    def clear_done(self):
+        """remove checkpoints after task finished"""
+        self.conn.delete(self.key + ":done")
+
+    def log(self, lines):
+        """append output lines to bounded log stream of task"""
+        if not lines:
+            return
+
+        log_key = self.LOG + self.entry_id
+        pipe = self.pipeline()
+        for line in lines:
+            pipe.xadd(
+                log_key,
+                {"line": line},
+                maxlen=self.LOG_MAXLEN,
+                approximate=True,
+            )
+        pipe.expire(log_key, self.TTL)
+        pipe.execute()
 
 
 class Monitor(RedisBase):
-    """look for messages"""
+    """consume tasks from stream"""
 
-    def get_tasks(self):
-        """get task list"""
-        response = self.conn.execute_command("JSON.GET", self.TASK_KEY)
-        tasks = json.loads(response.decode())
-        return tasks
+    BLOCK_MS = 5000
+    CLAIM_IDLE_MS = 5 * 60 * 1000
+
+    def __init__(self):
+        super().__init__()
+        self.executor = TaskExecutor()
 
     def bootstrap(self):
         """create custom builder"""
@@ -50,18 +179,16 @@ class Monitor(RedisBase):
             print("tubearchivist builder already created")
 
     def create_queue(self):
-        """set initial json object for queue"""
-        if self.conn.execute_command(f"EXISTS {self.TASK_KEY}"):
-            print(f"{self.TASK_KEY} already exists")
-            return
+        """create stream and consumer group if needed"""
+        try:
+            self.conn.xgroup_create(
+                self.STREAM, self.GROUP, id="0", mkstream=True
+            )
+        except redis.exceptions.ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
 
-        message = {
-            "created": int(datetime.now().strftime("%s")),
-            "tasks": {}
-        }
-        self.conn.execute_command(
-            "JSON.SET", self.TASK_KEY, ".", json.dumps(message)
-        )
+            print(f"{self.GROUP} group on {self.STREAM} already exists")
 
     @staticmethod
     def _create_builder():
@@ -74,82 +201,491 @@ class Monitor(RedisBase):
         subprocess.run(base + ["inspect", "--bootstrap"], check=True)
 
     def check_stored(self):
-        """check for any stored task since last watch"""
-        task = self.get_tasks()
-        if task["tasks"]:
-            print("found stored task:")
-            for task_name in task["tasks"]:
-                print(task_name)
-                Builder(task_name).run()
+        """resume entries delivered to this consumer before restart"""
+        response = self.conn.xreadgroup(
+            self.GROUP, self.CONSUMER, {self.STREAM: "0"}
+        )
+        entries = response[0][1] if response else []
+        if entries:
+            print(f"found {len(entries)} stored tasks")
+
+        self._submit(entries)
+
+    def reclaim(self):
+        """take over entries of consumers idle for too long"""
+        response = self.conn.xautoclaim(
+            self.STREAM,
+            self.GROUP,
+            self.CONSUMER,
+            self.CLAIM_IDLE_MS,
+            start_id="0-0",
+            count=10,
+        )
+        self._submit(response[1])
 
     def watch(self):
-        """watch for messages"""
+        """block for new entries, reclaim and heartbeat in between"""
         print("waiting for tasks")
-        watcher = self.conn.pubsub()
-        watcher.subscribe(self.TASK_KEY)
-        for i in watcher.listen():
-            if i["type"] == "message":
-                task = i["data"].decode()
-                print(task)
-                Builder(task).run()
+        while True:
+            self.executor.heartbeat()
+            self.reclaim()
+            response = self.conn.xreadgroup(
+                self.GROUP,
+                self.CONSUMER,
+                {self.STREAM: ">"},
+                count=1,
+                block=self.BLOCK_MS,
+            )
+            if response:
+                self._submit(response[0][1])
+
+    def _submit(self, entries):
+        """pass stream entries to executor"""
+        for entry_id, fields in entries:
+            if not fields:
+                # trimmed from stream while pending
+                self.conn.xack(self.STREAM, self.GROUP, entry_id)
+                continue
+
+            try:
+                task = json.loads(fields[b"task"].decode())
+                if not {"name", "task_name", "build"} <= set(task):
+                    raise ValueError("missing task keys")
+            except (KeyError, TypeError, ValueError) as err:
+                self._reject(entry_id.decode(), fields, err)
+                continue
+
+            self.executor.submit(entry_id.decode(), task)
+
+    def _reject(self, entry_id, fields, err):
+        """ack undecodable entry and keep it in failed set"""
+        print(f"{entry_id}: invalid task, move to failed: {err}")
+        raw = {
+            i.decode(): j.decode(errors="replace") for i, j in fields.items()
+        }
+        pipe = self.pipeline(transaction=True)
+        pipe.xack(self.STREAM, self.GROUP, entry_id)
+        pipe.zadd(self.FAILED, {entry_id: time.time()})
+        pipe.hset(BuildRecord.KEY + entry_id, mapping={
+            "state": "failed",
+            "failed_at": time.time(),
+            "error": f"invalid task: {err}",
+            "task": json.dumps(raw),
+        })
+        pipe.expire(BuildRecord.KEY + entry_id, BuildRecord.TTL)
+        pipe.execute()
+
+
+class TaskExecutor(RedisBase):
+    """run tasks in parallel, never two tasks of the same repo at once
+
+    A task is handed to the pool only when its repo is free, later tasks
+    of a busy repo wait in a per repo deque. Quiet windows and retry
+    backoff wait on timers, so pool threads only ever run builds.
+
+    Failing tasks are retried with exponential backoff, resuming after
+    the last completed step. The repo is free during the backoff. After
+    MAX_ATTEMPTS the task is acked and moved to the FAILED set.
+    """
+
+    WORKERS = int(os.environ.get("BUILD_WORKERS", 2))
+    MAX_ATTEMPTS = int(os.environ.get("BUILD_MAX_ATTEMPTS", 3))
+    BACKOFF_BASE = 30
+    BACKOFF_MAX = 600
+
+    def __init__(self):
+        super().__init__()
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.WORKERS, thread_name_prefix="build"
+        )
+        self._lock = threading.Lock()
+        self.busy_repos = set()
+        self.pending = {}
+        self.in_flight = set()
+
+    def submit(self, entry_id, task):
+        """queue task for execution, skip entries already submitted"""
+        with self._lock:
+            if entry_id in self.in_flight:
+                return
+
+            self.in_flight.add(entry_id)
+
+        print(f"{entry_id}: {task['task_name']} for {task['name']}")
+        try:
+            BuildRecord(entry_id).create(task)
+            wait_seconds = task.get("not_before", 0) - time.time()
+            if wait_seconds > 0:
+                print(
+                    f"{task['name']}: wait {int(wait_seconds)}s quiet window"
+                )
+                self._schedule(wait_seconds, entry_id, task)
+            else:
+                self._enqueue(entry_id, task)
+        except Exception:
+            # not scheduled, let the next reclaim submit it again
+            with self._lock:
+                self.in_flight.discard(entry_id)
+            raise
+
+    def _schedule(self, delay, entry_id, task):
+        """enqueue task after delay without holding a pool thread"""
+        timer = threading.Timer(delay, self._enqueue, (entry_id, task))
+        timer.daemon = True
+        timer.start()
+
+    def _enqueue(self, entry_id, task):
+        """start task if repo is free, else queue it behind the repo"""
+        repo = task["name"]
+        with self._lock:
+            if repo in self.busy_repos:
+                self.pending.setdefault(repo, deque()).append(
+                    (entry_id, task)
+                )
+                return
+
+            self.busy_repos.add(repo)
+
+        self.pool.submit(self._run, entry_id, task)
+
+    def _release_repo(self, repo):
+        """start next queued task of repo or mark repo as free"""
+        with self._lock:
+            queued = self.pending.get(repo)
+            if not queued:
+                self.pending.pop(repo, None)
+                self.busy_repos.discard(repo)
+                return
+
+            entry_id, task = queued.popleft()
+
+        self.pool.submit(self._run, entry_id, task)
+
+    def _run(self, entry_id, task):
+        """run one attempt of task, repo is reserved by caller"""
+        finished = True
+        try:
+            finished = self._attempt(entry_id, task)
+        except redis.exceptions.RedisError as err:
+            print(f"{entry_id}: left pending for reclaim: {err}")
+        finally:
+            if finished:
+                with self._lock:
+                    self.in_flight.discard(entry_id)
+
+            self._release_repo(task["name"])
+
+    def _attempt(self, entry_id, task):
+        """build task, return False if a retry is scheduled"""
+        record = BuildRecord(entry_id)
+        if self._is_superseded(entry_id, task):
+            self._skip(entry_id)
+            record.set_state("superseded")
+            return True
+
+        queue_wait = time.time() - record.requested
+        record.set_state("running", queue_wait_seconds=round(queue_wait, 1))
+        attempt = record.add_attempt()
+        try:
+            Builder(entry_id, task, record).run()
+        except Exception as err:
+            print(f"{entry_id}: attempt {attempt} failed: {err}")
+            if attempt >= self.MAX_ATTEMPTS:
+                self._fail(entry_id, task, record, err)
+                return True
+
+            backoff = min(
+                self.BACKOFF_BASE * 2 ** (attempt - 1), self.BACKOFF_MAX
+            )
+            record.set_state("retrying", error=str(err), retry_in=backoff)
+            self._schedule(backoff, entry_id, task)
+            return False
+
+        self.conn.xack(self.STREAM, self.GROUP, entry_id)
+        record.set_state("succeeded")
+        record.clear_done()
+        return True
+
+    def _fail(self, entry_id, task, record, err):
+        """give up on task, keep it in failed set for inspection"""
+        pipe = self.pipeline(transaction=True)
+        pipe.xack(self.STREAM, self.GROUP, entry_id)
+        pipe.zadd(self.FAILED, {entry_id: time.time()})
+        pipe.execute()
+        record.set_state("failed", error=str(err), task=json.dumps(task))
+
+    def _is_superseded(self, entry_id, task):
+        """check if a newer request of same repo and task type is queued"""
+        coalesce_key = task.get("coalesce_key")
+        if not coalesce_key:
+            return False
+
+        latest = self.conn.hget(self.LATEST, coalesce_key)
+        return bool(latest) and latest.decode() != entry_id
+
+    def _skip(self, entry_id):
+        """ack superseded entry and count saved build"""
+        print(f"{entry_id}: superseded by newer request, skip")
+        pipe = self.pipeline(transaction=True)
+        pipe.xack(self.STREAM, self.GROUP, entry_id)
+        pipe.hincrby(self.STATS, "builds_saved", 1)
+        pipe.execute()
+
+    def heartbeat(self):
+        """reset idle time of own entries, keeps them from being reclaimed"""
+        with self._lock:
+            entry_ids = list(self.in_flight)
+
+        if entry_ids:
+            self.conn.xclaim(
+                self.STREAM,
+                self.GROUP,
+                self.CONSUMER,
+                0,
+                entry_ids,
+                justid=True,
+            )
+
+
+class StepGraph:
+    """execute build steps in dependency order, independent in parallel
+
+    Steps are plain command lists, running in order, or dicts like
+    {"id": "push", "run": [...], "needs": ["tag"]} declaring what they
+    depend on.
+    """
+
+    WORKERS = int(os.environ.get("STEP_WORKERS", 4))
+
+    def __init__(self, steps):
+        self.steps = self._normalize(steps)
+
+    @staticmethod
+    def _normalize(steps):
+        """map step id to command and dependencies"""
+        normalized = {}
+        previous = False
+        for idx, step in enumerate(steps):
+            if isinstance(step, dict):
+                step_id = step["id"]
+                needs = set(step.get("needs", []))
+                command = step["run"]
+            else:
+                step_id = f"step-{idx}"
+                needs = {previous} if previous else set()
+                command = step
+
+            normalized[step_id] = {"run": command, "needs": needs}
+            previous = step_id
+
+        return normalized
+
+    def run(self, execute):
+        """call execute(step_id, command) for all steps, raise on failure"""
+        done = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            while len(done) < len(self.steps):
+                for step_id, step in self.steps.items():
+                    if step_id in done or step_id in running.values():
+                        continue
+
+                    if step["needs"] <= done:
+                        future = pool.submit(execute, step_id, step["run"])
+                        running[future] = step_id
+
+                if not running:
+                    raise ValueError(f"unresolvable steps: {self.steps}")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step_id = running.pop(future)
+                    future.result()
+                    done.add(step_id)
 
 
 class Builder(RedisBase):
     """execute task"""
 
     CLONE_BASE = "clone"
+    CACHE_BASE = "cache"
+    STEP_LINE = re.compile(r"^#\d+ \[(?!internal)")
+    CACHED_LINE = re.compile(r"^#\d+ CACHED")
+    PUSH_LINE = re.compile(r"^#\d+ pushing layers")
+    LOG_BATCH = 50
+    LOG_INTERVAL = 2
 
-    def __init__(self, task):
+    def __init__(self, entry_id, task_detail, record):
         super().__init__()
-        self.task = task
-        self.task_detail = False
+        self.entry_id = entry_id
+        self.task_detail = task_detail
+        self.record = record
+        self.task = task_detail["name"]
+        self.repo_dir = os.path.join(self.CLONE_BASE, self.task)
+        self.done = record.get_done()
+        self._lock = threading.Lock()
+        self.metrics = {
+            "total_steps": 0, "cached_steps": 0, "push_seconds": 0
+        }
 
     def run(self):
         """run all steps"""
-        self.get_task()
+        start = time.time()
         self.clone()
-        self.build()
-        self.remove_task()
+        self.metrics["clone_seconds"] = round(time.time() - start, 1)
+        self.record.set_fields(self.metrics)
 
-    def get_task(self):
-        """get what to execute"""
-        print("get task from redis")
-        response = self.conn.execute_command("JSON.GET", self.TASK_KEY)
-        response_json = json.loads(response.decode())
-        self.task_detail = response_json["tasks"][self.task]
+        start = time.time()
+        self.build()
+        build_seconds = time.time() - start - self.metrics["push_seconds"]
+        self.metrics["build_seconds"] = round(max(build_seconds, 0), 1)
+        self.save_metrics()
 
     def clone(self):
-        """clone repo to destination"""
+        """shallow fetch of the exact commit of the task"""
         if not self.task_detail["clone"]:
             print("skip clone")
             return
 
-        print("clone repo")
-        repo_dir = os.path.join(self.CLONE_BASE, self.task_detail["name"])
-        if os.path.exists(repo_dir):
-            command = ["git", "-C", repo_dir, "pull"]
-        else:
-            command = ["git", "clone", self.task_detail["clone"], repo_dir]
+        if not os.path.exists(os.path.join(self.repo_dir, ".git")):
+            print("init repo")
+            os.makedirs(self.repo_dir, exist_ok=True)
+            git = ["git", "-C", self.repo_dir]
+            subprocess.run(git + ["init", "--quiet"], check=True)
+            subprocess.run(
+                git + ["remote", "add", "origin", self.task_detail["clone"]],
+                check=True,
+            )
+
+        target = self.task_detail.get("commit") or self.task_detail.get(
+            "ref", "HEAD"
+        )
+        print(f"fetch {target}")
+        size_before = self._git_size()
+        git = ["git", "-C", self.repo_dir]
+        subprocess.run(
+            git + ["fetch", "--depth", "1", "--no-tags", "origin", target],
+            check=True,
+        )
+        subprocess.run(
+            git + ["checkout", "--force", "--detach", "FETCH_HEAD"],
+            check=True,
+        )
+        subprocess.run(git + ["clean", "-ffdx", "--quiet"], check=True)
+        self.metrics["clone_bytes"] = max(self._git_size() - size_before, 0)
 
-        subprocess.run(command, check=True)
+    def _git_size(self):
+        """bytes stored in .git of repo"""
+        total = 0
+        for root, _, files in os.walk(os.path.join(self.repo_dir, ".git")):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                if not os.path.islink(path):
+                    total += os.path.getsize(path)
+
+        return total
 
     def build(self):
         """build the container"""
         command_list = self.task_detail["build"]
-        if all(isinstance(i, list) for i in command_list):
-            for command in command_list:
-                print(f"running: {command}")
-                subprocess.run(command, check=True)
-        else:
-            command = ["docker", "buildx"] + self.task_detail["build"]
-            command.append(os.path.join(self.CLONE_BASE, self.task))
-            print(f"running: {command}")
-            subprocess.run(command, check=True)
+        if all(isinstance(i, (list, dict)) for i in command_list):
+            StepGraph(command_list).run(self._run_step)
+            return
+
+        cache_dir = self._get_cache_dir()
+        command = ["docker", "buildx"] + self.task_detail["build"] + [
+            "--progress", "plain",
+            "--cache-to", f"type=local,dest={cache_dir}-new,mode=max",
+        ]
+        for cache_from in {cache_dir, self._get_cache_dir("master")}:
+            if os.path.exists(cache_from):
+                command += ["--cache-from", f"type=local,src={cache_from}"]
+
+        command.append(self.repo_dir)
+        self._run_step("build", command)
+        self._rotate_cache(cache_dir)
+
+    def _get_cache_dir(self, branch=False):
+        """buildx cache directory per repo and branch"""
+        if not branch:
+            ref = self.task_detail.get("ref") or "refs/heads/master"
+            if ref.startswith("refs/tags/"):
+                branch = "release"
+            else:
+                branch = ref.removeprefix("refs/heads/")
+
+        return os.path.join(
+            self.CACHE_BASE, self.task, branch.replace("/", "-")
+        )
+
+    @staticmethod
+    def _rotate_cache(cache_dir):
+        """replace old cache with freshly exported, keeps size bounded"""
+        if not os.path.exists(f"{cache_dir}-new"):
+            return
+
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+
+        os.rename(f"{cache_dir}-new", cache_dir)
+
+    def _run_step(self, step_id, command):
+        """run single command, stream output to log and record timings"""
+        if step_id in self.done:
+            print(f"{self.task}: {step_id} done in earlier attempt, skip")
+            return
+
+        print(f"{self.task}: running {step_id}: {command}")
+        self.record.log([f"running {step_id}: {' '.join(command)}"])
+        start = time.time()
+        push_start = time.time() if step_id.startswith("push") else False
+        total_steps, cached_steps = 0, 0
+        lines, flushed = [], time.time()
+        with subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        ) as process:
+            for line in process.stdout:
+                print(f"{self.task}: {line}", end="")
+                lines.append(line.rstrip())
+                if self.STEP_LINE.match(line):
+                    total_steps += 1
+                elif self.CACHED_LINE.match(line):
+                    cached_steps += 1
+                elif not push_start and self.PUSH_LINE.match(line):
+                    push_start = time.time()
+
+                if len(lines) >= self.LOG_BATCH or (
+                    time.time() - flushed > self.LOG_INTERVAL
+                ):
+                    self.record.log(lines)
+                    lines, flushed = [], time.time()
+
+        self.record.log(lines)
+        end = time.time()
+        with self._lock:
+            self.metrics["total_steps"] += total_steps
+            self.metrics["cached_steps"] += cached_steps
+            self.metrics[f"step:{step_id}"] = round(end - start, 1)
+            if push_start:
+                self.metrics["push_seconds"] += round(end - push_start, 1)
+
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+        self.record.mark_done(step_id)
+
+    def save_metrics(self):
+        """store build metrics of task"""
+        total_steps = self.metrics["total_steps"]
+        if total_steps:
+            ratio = self.metrics["cached_steps"] / total_steps
+            self.metrics["cache_hit_ratio"] = round(ratio, 3)
 
-    def remove_task(self):
-        """remove task from redis queue"""
-        print("remove task from redis")
-        self.conn.json().delete(self.TASK_KEY, f".tasks.{self.task}")
+        print(f"{self.task}: metrics: {self.metrics}")
+        self.record.set_fields(self.metrics)
 
 
 if __name__ == "__main__":
@@ -157,7 +693,12 @@ if __name__ == "__main__":
     handler.bootstrap()
     handler.create_queue()
     handler.check_stored()
-    try:
-        handler.watch()
-    except KeyboardInterrupt:
-        print(" [X] cancle watch")
+    while True:
+        try:
+            handler.watch()
+        except redis.exceptions.RedisError as err:
+            print(f"redis error, restart watch: {err}")
+            time.sleep(handler.BLOCK_MS / 1000)
+        except KeyboardInterrupt:
+            print(" [X] cancle watch")
+            break
@@ -22,9 +22,12 @@ ssh $local_host 'gzip -df backup/backup.gz'
 # replace
 printf "\n  -> replace\n"
 ssh $local_host "docker exec -i postgres psql -U archivist -c 'DROP TABLE IF EXISTS ta_docker_stats;'"
+ssh $local_host "docker exec -i postgres psql -U archivist -c 'DROP TABLE IF EXISTS ta_docker_stats_daily;'"
+ssh $local_host "docker exec -i postgres psql -U archivist -c 'DROP TABLE IF EXISTS ta_docker_stats_weekly;'"
 ssh $local_host "docker exec -i postgres psql -U archivist -c 'DROP TABLE IF EXISTS ta_release;'"
 ssh $local_host "docker exec -i postgres psql -U archivist -c 'DROP TABLE IF EXISTS ta_roadmap;'"
 ssh $local_host "docker exec -i postgres psql -U archivist -c 'DROP TABLE IF EXISTS ta_version_stats;'"
+ssh $local_host "docker exec -i postgres psql -U archivist -c 'DROP TABLE IF EXISTS ta_version_archive_batch;'"
 ssh $local_host 'docker exec -i postgres psql -U archivist -d archivist < backup/backup'
 ssh $local_host "trash backup/backup"
 printf "\n  -> done\n"
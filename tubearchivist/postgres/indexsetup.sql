@@ -1,23 +1,92 @@
--- create ta_docker_stats table
+-- create ta_docker_stats table, range partitioned by month
 CREATE TABLE ta_docker_stats (
-    id SERIAL NOT NULL PRIMARY KEY,
+    id SERIAL NOT NULL,
     time_stamp INT NOT NULL,
     time_stamp_human VARCHAR(20) NOT NULL,
     last_updated INT NOT NULL,
     last_updated_human VARCHAR(20) NOT NULL,
     stars SMALLINT NOT NULL,
-    pulls INT NOT NULL
-);
+    pulls INT NOT NULL,
+    PRIMARY KEY (id, time_stamp)
+) PARTITION BY RANGE (time_stamp);
 
 -- index for time_stamp where queries
 CREATE INDEX docker_time_stamp ON ta_docker_stats (time_stamp DESC);
 
+-- catch rows outside of monthly partitions
+CREATE TABLE ta_docker_stats_default PARTITION OF ta_docker_stats DEFAULT;
+
+-- monthly partitions from first data until next month
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(
+            '2021-01-01'::date,
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '1 month',
+            interval '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF ta_docker_stats FOR VALUES FROM (%s) TO (%s)',
+            'ta_docker_stats_' || to_char(month_start, 'YYYY_MM'),
+            extract(epoch FROM month_start::timestamp)::int,
+            extract(epoch FROM (month_start + interval '1 month')::timestamp)::int
+        );
+    END LOOP;
+END $$;
+
 -- ingest old csv archive
 COPY ta_docker_stats(time_stamp,time_stamp_human,last_updated,last_updated_human,stars,pulls)
 FROM '/dockerstats.csv'
 DELIMITER ','
 CSV HEADER;
 
+-- create daily rollup of docker stats, max per utc day
+CREATE TABLE ta_docker_stats_daily (
+    day DATE NOT NULL PRIMARY KEY,
+    pulls INT NOT NULL,
+    pulls_delta INT,
+    stars SMALLINT NOT NULL
+);
+
+-- create weekly rollup of docker stats, week labeled by ending sunday
+CREATE TABLE ta_docker_stats_weekly (
+    week DATE NOT NULL PRIMARY KEY,
+    pulls INT NOT NULL,
+    pulls_delta INT,
+    stars SMALLINT NOT NULL
+);
+
+-- backfill daily rollup from raw table
+INSERT INTO ta_docker_stats_daily (day, pulls, stars)
+SELECT (to_timestamp(time_stamp) AT TIME ZONE 'UTC')::date, MAX(pulls), MAX(stars)
+FROM ta_docker_stats
+GROUP BY 1
+ON CONFLICT (day) DO UPDATE SET pulls = EXCLUDED.pulls, stars = EXCLUDED.stars;
+
+UPDATE ta_docker_stats_daily d SET pulls_delta = d.pulls - prev.pulls
+FROM (
+    SELECT day, LAG(pulls) OVER (ORDER BY day) AS pulls
+    FROM ta_docker_stats_daily
+) prev
+WHERE d.day = prev.day;
+
+-- backfill weekly rollup from daily rollup
+INSERT INTO ta_docker_stats_weekly (week, pulls, stars)
+SELECT day + (7 - EXTRACT(ISODOW FROM day))::int, MAX(pulls), MAX(stars)
+FROM ta_docker_stats_daily
+GROUP BY 1
+ON CONFLICT (week) DO UPDATE SET pulls = EXCLUDED.pulls, stars = EXCLUDED.stars;
+
+UPDATE ta_docker_stats_weekly w SET pulls_delta = w.pulls - prev.pulls
+FROM (
+    SELECT week, LAG(pulls) OVER (ORDER BY week) AS pulls
+    FROM ta_docker_stats_weekly
+) prev
+WHERE w.week = prev.week;
+
 -- create ta_version_stats table
 CREATE TABLE ta_version_stats (
     id SERIAL NOT NULL PRIMARY KEY,
@@ -26,6 +95,13 @@ CREATE TABLE ta_version_stats (
     latest_version VARCHAR(10) NOT NULL
 );
 
+-- create version archive batch table, marks committed archive runs
+CREATE TABLE ta_version_archive_batch (
+    batch_id VARCHAR(32) NOT NULL PRIMARY KEY,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    row_count INT NOT NULL
+);
+
 -- create release history table
 CREATE TABLE ta_release (
     id SERIAL NOT NULL PRIMARY KEY,
@@ -0,0 +1,61 @@
+-- one time migration: move ta_docker_stats to monthly range partitions
+-- docker exec -i postgres psql -U archivist < migrate_partition.sql
+BEGIN;
+
+ALTER TABLE ta_docker_stats RENAME TO ta_docker_stats_old;
+ALTER INDEX docker_time_stamp RENAME TO docker_time_stamp_old;
+ALTER SEQUENCE ta_docker_stats_id_seq RENAME TO ta_docker_stats_old_id_seq;
+
+-- create ta_docker_stats table, range partitioned by month
+CREATE TABLE ta_docker_stats (
+    id SERIAL NOT NULL,
+    time_stamp INT NOT NULL,
+    time_stamp_human VARCHAR(20) NOT NULL,
+    last_updated INT NOT NULL,
+    last_updated_human VARCHAR(20) NOT NULL,
+    stars SMALLINT NOT NULL,
+    pulls INT NOT NULL,
+    PRIMARY KEY (id, time_stamp)
+) PARTITION BY RANGE (time_stamp);
+
+-- index for time_stamp where queries
+CREATE INDEX docker_time_stamp ON ta_docker_stats (time_stamp DESC);
+
+-- catch rows outside of monthly partitions
+CREATE TABLE ta_docker_stats_default PARTITION OF ta_docker_stats DEFAULT;
+
+-- monthly partitions from first data until next month
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(
+            date_trunc(
+                'month',
+                (SELECT to_timestamp(MIN(time_stamp)) AT TIME ZONE 'UTC'
+                 FROM ta_docker_stats_old)
+            ),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '1 month',
+            interval '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF ta_docker_stats FOR VALUES FROM (%s) TO (%s)',
+            'ta_docker_stats_' || to_char(month_start, 'YYYY_MM'),
+            extract(epoch FROM month_start::timestamp)::int,
+            extract(epoch FROM (month_start + interval '1 month')::timestamp)::int
+        );
+    END LOOP;
+END $$;
+
+-- copy rows with their ids, continue sequence after highest id
+INSERT INTO ta_docker_stats
+SELECT id, time_stamp, time_stamp_human, last_updated, last_updated_human, stars, pulls
+FROM ta_docker_stats_old;
+
+SELECT setval('ta_docker_stats_id_seq', (SELECT COALESCE(MAX(id), 1) FROM ta_docker_stats));
+
+DROP TABLE ta_docker_stats_old;
+
+COMMIT;
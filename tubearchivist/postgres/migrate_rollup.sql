@@ -0,0 +1,49 @@
+-- one time migration: add docker stats rollups to existing database
+-- docker exec -i postgres psql -U archivist < migrate_rollup.sql
+BEGIN;
+
+-- create daily rollup of docker stats, max per utc day
+CREATE TABLE IF NOT EXISTS ta_docker_stats_daily (
+    day DATE NOT NULL PRIMARY KEY,
+    pulls INT NOT NULL,
+    pulls_delta INT,
+    stars SMALLINT NOT NULL
+);
+
+-- create weekly rollup of docker stats, week labeled by ending sunday
+CREATE TABLE IF NOT EXISTS ta_docker_stats_weekly (
+    week DATE NOT NULL PRIMARY KEY,
+    pulls INT NOT NULL,
+    pulls_delta INT,
+    stars SMALLINT NOT NULL
+);
+
+-- backfill daily rollup from raw table
+INSERT INTO ta_docker_stats_daily (day, pulls, stars)
+SELECT (to_timestamp(time_stamp) AT TIME ZONE 'UTC')::date, MAX(pulls), MAX(stars)
+FROM ta_docker_stats
+GROUP BY 1
+ON CONFLICT (day) DO UPDATE SET pulls = EXCLUDED.pulls, stars = EXCLUDED.stars;
+
+UPDATE ta_docker_stats_daily d SET pulls_delta = d.pulls - prev.pulls
+FROM (
+    SELECT day, LAG(pulls) OVER (ORDER BY day) AS pulls
+    FROM ta_docker_stats_daily
+) prev
+WHERE d.day = prev.day;
+
+-- backfill weekly rollup from daily rollup
+INSERT INTO ta_docker_stats_weekly (week, pulls, stars)
+SELECT day + (7 - EXTRACT(ISODOW FROM day))::int, MAX(pulls), MAX(stars)
+FROM ta_docker_stats_daily
+GROUP BY 1
+ON CONFLICT (week) DO UPDATE SET pulls = EXCLUDED.pulls, stars = EXCLUDED.stars;
+
+UPDATE ta_docker_stats_weekly w SET pulls_delta = w.pulls - prev.pulls
+FROM (
+    SELECT week, LAG(pulls) OVER (ORDER BY week) AS pulls
+    FROM ta_docker_stats_weekly
+) prev
+WHERE w.week = prev.week;
+
+COMMIT;
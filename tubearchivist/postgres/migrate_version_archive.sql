@@ -0,0 +1,12 @@
+-- one time migration: add version archive batch markers to existing database
+-- docker exec -i postgres psql -U archivist < migrate_version_archive.sql
+BEGIN;
+
+-- create version archive batch table, marks committed archive runs
+CREATE TABLE IF NOT EXISTS ta_version_archive_batch (
+    batch_id VARCHAR(32) NOT NULL PRIMARY KEY,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    row_count INT NOT NULL
+);
+
+COMMIT;
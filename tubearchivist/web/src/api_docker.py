@@ -1,10 +1,9 @@
 """hourly docker stats backup"""
 
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from src.db import DatabaseConnect
-
-import requests
+from src.http_client import ConditionalCache
 
 
 class DockerBackup:
@@ -23,11 +22,12 @@ class DockerBackup:
         self._get_image_stats()
         self._build_query()
         self._insert_line()
+        DockerRollup().update(self.image_stats)
         print("completed hourly docker stats backup")
 
     def _get_image_stats(self):
         """return dict for image"""
-        response = requests.get(self.URL, timeout=20).json()
+        response = ConditionalCache().get(self.URL, self._extract_stats)
         now = datetime.now()
 
         last_updated = response["last_updated"]
@@ -44,6 +44,16 @@ class DockerBackup:
 
         self.image_stats = image_stats
 
+    @staticmethod
+    def _extract_stats(response):
+        """keep only used fields of image response"""
+        response_json = response.json()
+        return {
+            "last_updated": response_json["last_updated"],
+            "star_count": response_json["star_count"],
+            "pull_count": response_json["pull_count"],
+        }
+
     def _build_query(self):
         """build ingest query for postgres"""
         keys = self.image_stats.keys()
@@ -62,6 +72,151 @@ class DockerBackup:
         handler.db_close()
 
 
+class DockerRollup:
+    """maintain daily and weekly rollups of ta_docker_stats"""
+
+    BUCKETS = {
+        "ta_docker_stats_daily": "day",
+        "ta_docker_stats_weekly": "week",
+    }
+
+    query_check = """
+        SELECT COALESCE(r.day, d.day) AS day,
+            r.pulls AS raw_pulls, d.pulls AS rollup_pulls
+        FROM (
+            SELECT (to_timestamp(time_stamp) AT TIME ZONE 'UTC')::date AS day,
+                MAX(pulls) AS pulls
+            FROM ta_docker_stats
+            GROUP BY 1
+        ) r
+        FULL OUTER JOIN ta_docker_stats_daily d ON r.day = d.day
+        WHERE r.pulls IS DISTINCT FROM d.pulls
+        ORDER BY 1;
+    """
+
+    def update(self, image_stats):
+        """add new hourly line to its day and week bucket"""
+        stamp = datetime.fromtimestamp(
+            image_stats["time_stamp"], tz=timezone.utc
+        )
+        day = stamp.date()
+        week = day + timedelta(days=6 - day.weekday())
+        values = (image_stats["pulls"], image_stats["stars"])
+
+        handler = DatabaseConnect()
+        for table, bucket in (
+            ("ta_docker_stats_daily", day), ("ta_docker_stats_weekly", week)
+        ):
+            for query in self._build_queries(table, bucket, values):
+                handler.db_execute(query)
+        handler.db_close()
+
+    def _build_queries(self, table, bucket, values):
+        """upsert max of bucket, then delta to previous bucket"""
+        column = self.BUCKETS[table]
+        upsert = (
+            f"INSERT INTO {table} ({column}, pulls, stars) "
+            + "VALUES (%s, %s, %s) "
+            + f"ON CONFLICT ({column}) DO UPDATE SET "
+            + f"pulls = GREATEST({table}.pulls, EXCLUDED.pulls), "
+            + f"stars = GREATEST({table}.stars, EXCLUDED.stars);",
+            (bucket,) + values,
+        )
+        delta = (
+            f"UPDATE {table} SET pulls_delta = pulls - ("
+            + f"SELECT pulls FROM {table} WHERE {column} < %s "
+            + f"ORDER BY {column} DESC LIMIT 1) "
+            + f"WHERE {column} = %s;",
+            (bucket, bucket),
+        )
+        return upsert, delta
+
+    def check(self):
+        """compare daily rollup against raw table"""
+        handler = DatabaseConnect()
+        rows = handler.db_execute(self.query_check)
+        handler.db_close()
+
+        if not rows:
+            print("docker stats rollup consistent")
+            return
+
+        for row in rows:
+            print(f"rollup mismatch: {dict(row)}")
+
+        raise ValueError(f"{len(rows)} days in docker rollup out of sync")
+
+
+class DockerStatsPartition:
+    """monthly partitions and retention for ta_docker_stats"""
+
+    TABLE = "ta_docker_stats"
+    MONTHS_AHEAD = 2
+    RETENTION_MONTHS = 12
+
+    query_compact = """
+        DELETE FROM ta_docker_stats
+        WHERE time_stamp < %s
+        AND (id, time_stamp) NOT IN (
+            SELECT DISTINCT ON (
+                (to_timestamp(time_stamp) AT TIME ZONE 'UTC')::date
+            ) id, time_stamp
+            FROM ta_docker_stats
+            WHERE time_stamp < %s
+            ORDER BY (to_timestamp(time_stamp) AT TIME ZONE 'UTC')::date,
+                pulls DESC, time_stamp DESC
+        );
+    """
+
+    def run(self):
+        """create upcoming partitions, compact old rows"""
+        self.ensure_partitions()
+        self.compact()
+
+    def ensure_partitions(self):
+        """create partitions for this and upcoming months"""
+        now = datetime.now(tz=timezone.utc)
+        handler = DatabaseConnect()
+        for offset in range(self.MONTHS_AHEAD + 1):
+            start = self._month_start(now.year, now.month + offset)
+            end = self._month_start(now.year, now.month + offset + 1)
+            name = f"{self.TABLE}_{start.strftime('%Y_%m')}"
+            query = (
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {self.TABLE} "
+                + "FOR VALUES FROM (%s) TO (%s);",
+                (int(start.timestamp()), int(end.timestamp())),
+            )
+            handler.db_execute(query)
+        handler.db_close()
+
+    def compact(self):
+        """keep only the max pulls row per day in months past retention"""
+        now = datetime.now(tz=timezone.utc)
+        cutoff = self._month_start(now.year, now.month - self.RETENTION_MONTHS)
+        cutoff_stamp = int(cutoff.timestamp())
+        handler = DatabaseConnect()
+        handler.db_execute((self.query_compact, (cutoff_stamp, cutoff_stamp)))
+        deleted = handler.cur.rowcount
+        handler.db_close()
+        print(f"compacted {deleted} hourly rows before {cutoff.date()}")
+
+    @staticmethod
+    def _month_start(year, month):
+        """first of month in utc, month may overflow the year"""
+        year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+        return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
 def run_docker_backup():
     """hourly task to store docker stats"""    
     DockerBackup().run_backup()
+
+
+def run_rollup_check():
+    """weekly task to validate docker stats rollup"""
+    DockerRollup().check()
+
+
+def run_docker_maintenance():
+    """daily task to manage partitions and retention"""
+    DockerStatsPartition().run()
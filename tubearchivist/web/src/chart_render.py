@@ -0,0 +1,164 @@
+"""render charts headless, run as separate process
+
+usage: python -m src.chart_render < charts.json
+"""
+
+import json
+import os
+import sys
+
+import matplotlib as mpl
+
+mpl.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import pandas as pd  # noqa: E402
+
+
+COLORS = {
+    "main-bg": "#00202f",
+    "highlight-bg": "#00293b",
+    "highlight-error": "#990202",
+    "highlight-error-light": "#c44343",
+    "highlight-bg-transparent": "#00293baf",
+    "main-font": "#eeeeee",
+    "accent-font-dark": "#259485",
+    "accent-font-light": "#97d4c8",
+}
+
+mpl.rcParams["axes.facecolor"] = COLORS.get("highlight-bg")
+mpl.rcParams["axes.titlecolor"] = COLORS.get("main-font")
+mpl.rcParams["axes.titlesize"] = 20
+mpl.rcParams["figure.facecolor"] = COLORS.get("main-bg")
+mpl.rcParams["lines.linewidth"] = 2
+mpl.rcParams["xtick.color"] = COLORS.get("main-font")
+mpl.rcParams["xtick.labelcolor"] = COLORS.get("main-font")
+mpl.rcParams["ytick.color"] = COLORS.get("main-font")
+mpl.rcParams["ytick.labelcolor"] = COLORS.get("main-font")
+mpl.rcParams["grid.color"] = COLORS.get("main-font")
+mpl.rcParams["grid.linestyle"] = "--"
+mpl.rcParams["grid.alpha"] = 0.5
+
+
+class ChartRender:
+    """render charts from json payload in all output sizes"""
+
+    SIZES = {
+        "": 300,
+        "-thumb": 60,
+    }
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def run(self):
+        """render every requested chart"""
+        for chart in self.payload["charts"]:
+            if chart["kind"] == "cumulative":
+                df = self._load_df(chart["rows"])
+                self._plot_daily_total(df, chart["releases"], chart["path"])
+            elif chart["kind"] == "weekly":
+                df = self._load_df(chart["rows"])
+                self.weekly_bar(df, chart["path"])
+            else:
+                raise ValueError(f"unknown chart: {chart['kind']}")
+
+            print(f"rendered {chart['kind']} chart")
+
+    @staticmethod
+    def _load_df(rows):
+        """build dataframe from rollup rows"""
+        df = pd.DataFrame(rows)
+        df["time_stamp"] = pd.to_datetime(df["time_stamp"])
+        df.set_index("time_stamp", inplace=True)
+
+        return df
+
+    def _save(self, path):
+        """save current figure atomically in all sizes, then close"""
+        base, ext = os.path.splitext(path)
+        for suffix, dpi in self.SIZES.items():
+            final_path = f"{base}{suffix}{ext}"
+            tmp_path = f"{base}{suffix}.tmp{ext}"
+            plt.savefig(tmp_path, dpi=dpi)
+            os.replace(tmp_path, final_path)
+
+        plt.close("all")
+
+    def _plot_daily_total(self, df, release_rows, path):
+        """create daily total plot"""
+        plt.figure()
+        half_df = self._calc_half_df(df)
+        plt.plot(df, color=COLORS.get("highlight-error"), zorder=3)
+        self._add_releases(release_rows, half_df)
+        plt.title("Cumulative Docker Pulls")
+        self._save(path)
+
+    def _calc_half_df(self, df):
+        """calc the middle of df height"""
+        return (df["pulls"].max() - df["pulls"].min()) // 2 + df["pulls"].min()
+
+    def _add_releases(self, release_rows, half_df):
+        """add release vert line to plt"""
+        version_colors = {
+            "v0.2.2": COLORS.get("accent-font-light"),
+            "v0.3.1": COLORS.get("accent-font-dark"),
+            "v0.3.3": COLORS.get("accent-font-light"),
+        }
+        release = pd.DataFrame(release_rows)
+        release["time_stamp"] = pd.to_datetime(release["time_stamp"], unit="s")
+
+        for ind in release.index:
+            label = release["release_version"][ind]
+            x_axis = release["time_stamp"][ind]
+            if (match := version_colors.get(label)) is None:
+                match = COLORS.get("main-font")
+                linewidth=0.5
+            else:
+                plt.text(
+                    x=x_axis,
+                    y=half_df,
+                    s=label,
+                    color="black",
+                    rotation=90,
+                    verticalalignment="center",
+                    horizontalalignment="center",
+                    bbox={"facecolor": match, "edgecolor": 'none'},
+                )
+                linewidth=1
+
+            plt.axvline(
+                x=x_axis,
+                linestyle="--",
+                color=match,
+                linewidth=linewidth,
+                zorder=2,
+            )
+
+    def weekly_bar(self, weekly_diff, path):
+        """create weekly bar chart from weekly pull deltas"""
+        plt.figure()
+        weekly_diff = weekly_diff.reset_index()
+        col = [COLORS.get("accent-font-light") for i in weekly_diff["pulls"]]
+        col[-1] = COLORS.get("highlight-error")
+
+        plt.bar(
+            weekly_diff["time_stamp"],
+            weekly_diff["pulls"],
+            width=3,
+            color=col,
+            zorder=1,
+        )
+        plt.grid(zorder=2, axis="y")
+        plt.title("Weekly Docker Pulls")
+        self._save(path)
+
+
+def main():
+    """read payload from stdin"""
+    payload = json.loads(sys.stdin.read())
+    ChartRender(payload).run()
+
+
+if __name__ == "__main__":
+    main()
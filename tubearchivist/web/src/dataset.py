@@ -1,40 +1,22 @@
 """analyze data sets from pg"""
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import pandas as pd
+import json
+import os
+import shutil
+import subprocess
+import sys
+from hashlib import sha256
 
 from src.db import DatabaseConnect
 
 
-COLORS = {
-    "main-bg": "#00202f",
-    "highlight-bg": "#00293b",
-    "highlight-error": "#990202",
-    "highlight-error-light": "#c44343",
-    "highlight-bg-transparent": "#00293baf",
-    "main-font": "#eeeeee",
-    "accent-font-dark": "#259485",
-    "accent-font-light": "#97d4c8",
-}
-
-mpl.rcParams["axes.facecolor"] = COLORS.get("highlight-bg")
-mpl.rcParams["axes.titlecolor"] = COLORS.get("main-font")
-mpl.rcParams["axes.titlesize"] = 20
-mpl.rcParams["figure.facecolor"] = COLORS.get("main-bg")
-mpl.rcParams["lines.linewidth"] = 2
-mpl.rcParams["xtick.color"] = COLORS.get("main-font")
-mpl.rcParams["xtick.labelcolor"] = COLORS.get("main-font")
-mpl.rcParams["ytick.color"] = COLORS.get("main-font")
-mpl.rcParams["ytick.labelcolor"] = COLORS.get("main-font")
-mpl.rcParams["grid.color"] = COLORS.get("main-font")
-mpl.rcParams["grid.linestyle"] = "--"
-mpl.rcParams["grid.alpha"] = 0.5
-
-
 class Pulls:
     """analyze docker pulls"""
 
+    CUMULATIVE_PATH = "/data/plot-cumulative-docker.png"
+    WEEKLY_PATH = "/data/plot-weekly-docker.png"
+    STATE_PATH = "/data/chart-state.json"
+
     query_pulls = """
         SELECT time_stamp, pulls
         FROM ta_docker_stats
@@ -42,6 +24,20 @@ class Pulls:
         ORDER BY time_stamp DESC;
     """
 
+    query_daily = """
+        SELECT day AS time_stamp, pulls
+        FROM ta_docker_stats_daily
+        WHERE day >= '2022-03-01'
+        ORDER BY day;
+    """
+
+    query_weekly = """
+        SELECT week AS time_stamp, pulls_delta AS pulls
+        FROM ta_docker_stats_weekly
+        WHERE week >= '2022-03-01' AND pulls_delta IS NOT NULL
+        ORDER BY week;
+    """
+
     query_release = """
         SELECT time_stamp, release_version
         FROM ta_release
@@ -49,112 +45,96 @@ class Pulls:
         ORDER BY time_stamp;
     """
 
+    def __init__(self):
+        self.state = self._load_state()
+
     def build_plots(self):
-        """build plots from dataframe"""
-        pull_rows = self.get_pull_rows()
-        self.cumulative(pull_rows)
-        self.weekly_bar(pull_rows)
+        """rerender charts whose rollup rows changed"""
+        charts = []
+        daily_rows = self._get_rows(self.query_daily)
+        release_rows = self._get_rows(self.query_release)
+        if self._is_changed(
+            "cumulative", self.CUMULATIVE_PATH, daily_rows, release_rows
+        ):
+            charts.append({
+                "kind": "cumulative",
+                "path": self.CUMULATIVE_PATH,
+                "rows": daily_rows,
+                "releases": release_rows,
+            })
+        else:
+            print("cumulative chart unchanged, skip render")
+
+        weekly_rows = self._get_rows(self.query_weekly)
+        if self._is_changed("weekly", self.WEEKLY_PATH, weekly_rows):
+            charts.append({
+                "kind": "weekly",
+                "path": self.WEEKLY_PATH,
+                "rows": weekly_rows,
+            })
+        else:
+            print("weekly chart unchanged, skip render")
+
+        if charts:
+            self._render(charts)
+
+        self._save_state()
+
+    @staticmethod
+    def _render(charts):
+        """render in separate process, keeps matplotlib out of workers"""
+        python = sys.executable
+        if not os.path.basename(python).startswith("python"):
+            # sys.executable is the uwsgi binary inside workers
+            python = shutil.which("python3") or shutil.which("python")
+
+        payload = json.dumps({"charts": charts}, default=str)
+        subprocess.run(
+            [python, "-m", "src.chart_render"],
+            input=payload.encode(),
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            check=True,
+        )
 
-    def get_pull_rows(self):
+    @staticmethod
+    def _get_rows(query):
         """get rows from pg"""
         handler = DatabaseConnect()
-        rows = handler.db_execute(self.query_pulls)
+        rows = handler.db_execute(query)
         handler.db_close()
 
-        return rows
+        return [dict(i) for i in rows]
+
+    def _load_state(self):
+        """load hashes of last rendered data"""
+        if not os.path.exists(self.STATE_PATH):
+            return {}
+
+        with open(self.STATE_PATH, "r", encoding="utf-8") as f:
+            return json.loads(f.read())
+
+    def _save_state(self):
+        """write hashes of rendered data"""
+        with open(self.STATE_PATH, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self.state))
+
+    def _is_changed(self, chart, path, *data):
+        """check if underlying data changed since last render"""
+        serialized = json.dumps(data, sort_keys=True, default=str)
+        digest = sha256(serialized.encode()).hexdigest()
+        changed = self.state.get(chart) != digest or not os.path.exists(path)
+        self.state[chart] = digest
 
-    def cumulative(self, rows):
-        """build cumulative plot"""
-        df = self._load_df(rows)
-        release_rows = self._get_release_rows()
-        self._plot_daily_total(df, release_rows)
+        return changed
 
-    def _get_release_rows(self):
-        """get release dates and versions"""
+    def get_pull_rows(self):
+        """get rows from pg"""
         handler = DatabaseConnect()
-        rows = handler.db_execute(self.query_release)
+        rows = handler.db_execute(self.query_pulls)
         handler.db_close()
 
         return rows
 
-    def _load_df(self, rows, resample="D"):
-        """build dataframe from pull rows"""
-        df = pd.DataFrame(rows)
-        df["time_stamp"] = pd.to_datetime(df["time_stamp"], unit="s")
-        df.set_index("time_stamp", inplace=True)
-
-        return df.resample(resample).max()
-
-    def _plot_daily_total(self, df, release_rows):
-        """create daily total plot"""
-        half_df = self._calc_half_df(df)
-        plt.plot(df, color=COLORS.get("highlight-error"), zorder=3)
-        self._add_releases(release_rows, half_df)
-        plt.title("Cumulative Docker Pulls")
-        plt.savefig("/data/plot-cumulative-docker.png", dpi=300)
-        plt.figure()
-
-    def _calc_half_df(self, df):
-        """calc the middle of df height"""
-        return (df["pulls"].max() - df["pulls"].min()) // 2 + df["pulls"].min()
-
-    def _add_releases(self, release_rows, half_df):
-        """add release vert line to plt"""
-        version_colors = {
-            "v0.2.2": COLORS.get("accent-font-light"),
-            "v0.3.1": COLORS.get("accent-font-dark"),
-            "v0.3.3": COLORS.get("accent-font-light"),
-        }
-        release = pd.DataFrame(release_rows)
-        release["time_stamp"] = pd.to_datetime(release["time_stamp"], unit="s")
-
-        for ind in release.index:
-            label = release["release_version"][ind]
-            x_axis = release["time_stamp"][ind]
-            if (match := version_colors.get(label)) is None:
-                match = COLORS.get("main-font")
-                linewidth=0.5
-            else:
-                plt.text(
-                    x=x_axis,
-                    y=half_df,
-                    s=label,
-                    color="black",
-                    rotation=90,
-                    verticalalignment="center",
-                    horizontalalignment="center",
-                    bbox={"facecolor": match, "edgecolor": 'none'},
-                )
-                linewidth=1
-
-            plt.axvline(
-                x=x_axis,
-                linestyle="--",
-                color=match,
-                linewidth=linewidth,
-                zorder=2,
-            )
-
-    def weekly_bar(self, rows):
-        """create weekly bar chart"""
-        weekly = self._load_df(rows, resample="W")
-        weekly_diff = weekly.diff().dropna().reset_index()
-        col = [COLORS.get("accent-font-light") for i in weekly_diff["pulls"]]
-        col[-1] = COLORS.get("highlight-error")
-
-        plt.bar(
-            weekly_diff["time_stamp"],
-            weekly_diff["pulls"],
-            width=3,
-            color=col,
-            zorder=1,
-        )
-        plt.grid(zorder=2, axis="y")
-        plt.title("Weekly Docker Pulls")
-        plt.savefig("/data/plot-weekly-docker.png", dpi=300)
-        plt.figure()
-        plt.close()
-
 
 def run_chart_recreate():
     """function to call from scheduler"""
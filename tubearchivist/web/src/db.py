@@ -1,33 +1,169 @@
 """handle postgres integration"""
 
+import os
+import threading
+import time
+
 import psycopg2
 import psycopg2.extras
+from psycopg2.pool import ThreadedConnectionPool
 from src.ta_config import get_config
 
 
+class ConnectionPool:
+    """bounded per worker postgres connection pool"""
+
+    MIN_CONN = 1
+    MAX_CONN = 4
+    WAIT_TIMEOUT = 10
+    HEALTH_CHECK_INTERVAL = 30
+
+    _instance = False
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        config = get_config()["postgres"]
+        self.pool = ThreadedConnectionPool(
+            self.MIN_CONN,
+            self.MAX_CONN,
+            host=config["db_host"],
+            database=config["db_database"],
+            user=config["db_user"],
+            password=config["db_password"],
+        )
+        self.slots = threading.BoundedSemaphore(self.MAX_CONN)
+        self.stats_lock = threading.Lock()
+        self.last_used = {}
+        self.stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "reconnects": 0,
+            "in_use": 0,
+            "max_size": self.MAX_CONN,
+        }
+
+    @classmethod
+    def get(cls):
+        """return pool of this process, recreate after fork"""
+        with cls._instance_lock:
+            instance = cls._instance
+            if not instance or instance.pid != os.getpid():
+                instance = cls()
+                instance.pid = os.getpid()
+                cls._instance = instance
+
+        return instance
+
+    def checkout(self):
+        """get healthy connection, wait if pool is exhausted"""
+        if not self.slots.acquire(blocking=False):
+            self._count("waits")
+            if not self.slots.acquire(timeout=self.WAIT_TIMEOUT):
+                raise psycopg2.pool.PoolError("connection pool exhausted")
+
+        try:
+            conn = self.pool.getconn()
+            if not self._is_healthy(conn):
+                conn = self.replace(conn)
+        except Exception:
+            self.slots.release()
+            raise
+
+        self._count("checkouts")
+        self._count("in_use")
+        return conn
+
+    def checkin(self, conn):
+        """return connection to pool, close if broken"""
+        if conn:
+            self.last_used[id(conn)] = time.monotonic()
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+        self._count("in_use", -1)
+        self.slots.release()
+
+    def replace(self, conn):
+        """drop dead connection and open a new one in its place"""
+        self._count("reconnects")
+        self.last_used.pop(id(conn), None)
+        self.pool.putconn(conn, close=True)
+        return self.pool.getconn()
+
+    def _is_healthy(self, conn):
+        """ping connections idle for longer than health check interval"""
+        if conn.closed:
+            return False
+
+        idle = time.monotonic() - self.last_used.get(id(conn), 0)
+        if idle < self.HEALTH_CHECK_INTERVAL:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+        return True
+
+    def _count(self, key, value=1):
+        """increase stats counter"""
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def get_stats(self):
+        """return copy of pool metrics"""
+        with self.stats_lock:
+            return self.stats.copy()
+
+
 class DatabaseConnect:
     """ handle db """
 
-    CONFIG = get_config()
-
     def __init__(self):
+        self.pool = ConnectionPool.get()
         self.conn, self.cur = self._db_connect()
+        self.checked_out = True
+        self.executed = False
 
     def _db_connect(self):
         """returns connection and curser"""
-        # Connect to database
-        conn = psycopg2.connect(
-            host=self.CONFIG['postgres']['db_host'],
-            database=self.CONFIG['postgres']['db_database'],
-            user=self.CONFIG['postgres']['db_user'],
-            password=self.CONFIG['postgres']['db_password']
-        )
+        # Check out connection from pool
+        conn = self.pool.checkout()
         # Open a cursor to perform database operations
         cur = conn.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
         return conn, cur
 
     def db_execute(self, query):
-        """run a query"""
+        """run a query, reconnect once on dead connection"""
+        try:
+            try:
+                rows = self._execute(query)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if not self.conn.closed or self.executed:
+                    # conn is alive or had earlier statements, can't replay
+                    raise
+
+                self._reconnect()
+                rows = self._execute(query)
+        except Exception:
+            self._release(rollback=True)
+            raise
+
+        self.executed = True
+        return rows
+
+    def _reconnect(self):
+        """replace dead connection with a fresh one"""
+        dead_conn, self.conn, self.cur = self.conn, False, False
+        self.conn = self.pool.replace(dead_conn)
+        self.cur = self.conn.cursor(
+            cursor_factory=psycopg2.extras.RealDictCursor
+        )
+
+    def _execute(self, query):
+        """execute on current cursor"""
         if isinstance(query, str):
             self.cur.execute(
                 query
@@ -42,7 +178,39 @@ class DatabaseConnect:
         return rows
 
     def db_close(self):
-        """clean close the conn and curser"""
-        self.conn.commit()
-        self.cur.close()
-        self.conn.close()
+        """commit and return the conn to the pool"""
+        if not self.checked_out:
+            return
+
+        try:
+            self.conn.commit()
+        except Exception:
+            self._release(rollback=True)
+            raise
+
+        self._release()
+
+    def _release(self, rollback=False):
+        """close cursor and give connection back, only once"""
+        if not self.checked_out:
+            return
+
+        conn, self.checked_out = self.conn, False
+        if self.cur and not self.cur.closed:
+            self.cur.close()
+
+        if rollback and conn and not conn.closed:
+            try:
+                conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                pass
+
+        self.pool.checkin(conn)
+
+
+def get_pool_stats():
+    """return metrics of connection pool in this worker"""
+    pool = ConnectionPool.get()
+    stats = pool.get_stats()
+    stats.update({"pid": os.getpid()})
+    return stats
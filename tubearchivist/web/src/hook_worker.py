@@ -0,0 +1,78 @@
+"""process queued webhooks in background threads"""
+
+import os
+import threading
+import time
+
+from src.ta_redis import HookQueue, HookSteps
+from src.webhook_docker import DockerHook
+from src.webhook_github import GithubHook
+
+
+class HookWorker:
+    """consume hook queue, retry failed hooks with backoff"""
+
+    WORKERS = 2
+    DEQUEUE_TIMEOUT = 5
+
+    _started_pid = False
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.queue = HookQueue()
+
+    def run(self):
+        """process jobs forever"""
+        while True:
+            try:
+                self.queue.promote_due()
+                raw, job = self.queue.dequeue(self.DEQUEUE_TIMEOUT)
+                if raw:
+                    self.process(raw, job)
+            except Exception as err:
+                print(f"hook queue unavailable: {err}")
+                time.sleep(self.DEQUEUE_TIMEOUT)
+
+    def process(self, raw, job):
+        """run single job"""
+        started = time.time()
+        try:
+            self._dispatch(job)
+        except Exception as err:
+            print(f"{job['source']} hook {job['id']} failed: {err!r}")
+            self.queue.retry(raw, job, repr(err))
+            return
+
+        self.queue.done(raw, job, started)
+        print(
+            f"{job['source']} hook {job['id']} done, "
+            + f"queued {started - job['enqueued']:.2f}s, "
+            + f"processed {time.time() - started:.2f}s"
+        )
+
+    @staticmethod
+    def _dispatch(job):
+        """hand hook to matching handler"""
+        if job["source"] == "github":
+            steps = HookSteps(job["id"])
+            GithubHook(hook=job["hook"], steps=steps).create_hook_task()
+        elif job["source"] == "docker":
+            message = DockerHook(hook=job["hook"]).process()
+            print(message, "hook sent to discord")
+        else:
+            raise ValueError(f"unknown hook source: {job['source']}")
+
+    @classmethod
+    def start(cls):
+        """start worker threads once per process"""
+        with cls._lock:
+            if cls._started_pid == os.getpid():
+                return
+
+            cls._started_pid = os.getpid()
+
+        for i in range(cls.WORKERS):
+            thread = threading.Thread(
+                target=cls().run, name=f"hook-worker-{i}", daemon=True
+            )
+            thread.start()
@@ -0,0 +1,212 @@
+"""shared outbound http client with pooled sessions per host"""
+
+import json
+import os
+import threading
+import time
+from hashlib import sha1
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from src.ta_redis import RedisBase
+from urllib3.util.retry import Retry
+
+
+class OutboundRetry(Retry):
+    """retry idempotent requests on 5xx and 429, POST only on 429"""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        """POST is not in allowed_methods, still retry rate limits"""
+        if method.upper() == "POST" and status_code == 429:
+            return bool(self.total)
+
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class HttpClient:
+    """keep-alive sessions per host, uniform timeouts and retries
+
+    Set HTTP_HOST_OVERRIDE to redirect hosts to a local stub server,
+    e.g. "api.github.com=http://127.0.0.1:8001,*=http://127.0.0.1:8002".
+    """
+
+    TIMEOUT = (5, 20)
+    POOL_SIZE = 10
+    RETRIES = 3
+    BACKOFF = 0.5
+    RETRY_STATUS = [429, 500, 502, 503, 504]
+    BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    _lock = threading.Lock()
+    _sessions = {}
+    _pid = False
+    _histograms = {}
+
+    def __init__(self):
+        self.overrides = self._parse_overrides()
+
+    def get(self, url, **kwargs):
+        """send GET request"""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """send POST request"""
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        """send DELETE request"""
+        return self.request("DELETE", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """send request through pooled session of host"""
+        kwargs.setdefault("timeout", self.TIMEOUT)
+        url = self._apply_override(url)
+        host = urlsplit(url).netloc
+        session = self._get_session(host)
+        start = time.monotonic()
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            self._observe(host, time.monotonic() - start)
+
+    def _get_session(self, host):
+        """get or create session for host, recreate after fork"""
+        with self._lock:
+            if HttpClient._pid != os.getpid():
+                HttpClient._sessions = {}
+                HttpClient._pid = os.getpid()
+
+            session = self._sessions.get(host)
+            if not session:
+                session = self._build_session()
+                self._sessions[host] = session
+
+        return session
+
+    def _build_session(self):
+        """session with keep-alive pool and retry"""
+        retry = OutboundRetry(
+            total=self.RETRIES,
+            backoff_factor=self.BACKOFF,
+            status_forcelist=self.RETRY_STATUS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.POOL_SIZE, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _observe(self, host, elapsed):
+        """add request duration to latency histogram of host"""
+        with self._lock:
+            histogram = self._histograms.get(host)
+            if not histogram:
+                histogram = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "buckets": {str(i): 0 for i in self.BUCKETS + ["+Inf"]},
+                }
+                self._histograms[host] = histogram
+
+            histogram["count"] += 1
+            histogram["sum"] += elapsed
+            for bucket in self.BUCKETS:
+                if elapsed <= bucket:
+                    histogram["buckets"][str(bucket)] += 1
+            histogram["buckets"]["+Inf"] += 1
+
+    @staticmethod
+    def _parse_overrides():
+        """read host overrides from environ"""
+        overrides = {}
+        raw = os.environ.get("HTTP_HOST_OVERRIDE")
+        if not raw:
+            return overrides
+
+        for item in raw.split(","):
+            host, target = item.split("=", maxsplit=1)
+            overrides[host.strip()] = urlsplit(target.strip())
+
+        return overrides
+
+    def _apply_override(self, url):
+        """point url to stub server if configured"""
+        if not self.overrides:
+            return url
+
+        parsed = urlsplit(url)
+        target = self.overrides.get(parsed.netloc, self.overrides.get("*"))
+        if not target:
+            return url
+
+        return urlunsplit(parsed._replace(
+            scheme=target.scheme, netloc=target.netloc
+        ))
+
+    def get_stats(self):
+        """get latency histograms of this worker"""
+        with self._lock:
+            return {
+                host: {**i, "buckets": i["buckets"].copy()}
+                for host, i in self._histograms.items()
+            }
+
+
+class ConditionalCache(RedisBase):
+    """revalidate GET requests with stored ETag and Last-Modified
+
+    Stores the parsed result next to the validators, a 304 answer returns
+    it without downloading or parsing the body again.
+    """
+
+    KEY_BASE = f"{RedisBase.NAME_SPACE}httpcache"
+    TTL = 30 * 24 * 60 * 60
+
+    def get(self, url, parse):
+        """return parse(response) for url, cached result on 304"""
+        key = f"{self.KEY_BASE}:{sha1(url.encode()).hexdigest()}"
+        cached = {
+            i.decode(): j.decode() for i, j in self.conn.hgetall(key).items()
+        }
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = HttpClient().get(url, headers=headers)
+        if response.status_code == 304 and cached:
+            self.conn.hincrby(f"{self.KEY_BASE}:stats", "hits", 1)
+            return json.loads(cached["parsed"])
+
+        self.conn.hincrby(f"{self.KEY_BASE}:stats", "misses", 1)
+        response.raise_for_status()
+        parsed = parse(response)
+        self._store(key, response, parsed)
+
+        return parsed
+
+    def _store(self, key, response, parsed):
+        """store validators and parsed result if response has any"""
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        validators = {i: j for i, j in validators.items() if j}
+        if not validators:
+            return
+
+        pipe = self.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping={**validators, "parsed": json.dumps(parsed)})
+        pipe.expire(key, self.TTL)
+        pipe.execute()
+
+    def get_stats(self):
+        """get hit and miss counts"""
+        stats = self.conn.hgetall(f"{self.KEY_BASE}:stats")
+        return {i.decode(): int(j) for i, j in stats.items()}
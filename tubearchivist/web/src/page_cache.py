@@ -0,0 +1,170 @@
+"""shared full page cache with stale-while-revalidate"""
+
+import threading
+import time
+from os import environ
+from uuid import uuid4
+
+import redis
+from src.release_cache import ReleaseCache
+from src.response_cache import RenderedResponse
+from src.ta_redis import RedisBase
+
+
+class PageCache(RedisBase):
+    """cache rendered pages in redis, one worker refreshes stale copies
+
+    A page is fresh for TTL seconds and as long as the release generation
+    did not move. After that the worker holding the refresh lock renders
+    the page again while all other workers keep serving the stale copy.
+    Compressed bodies are built once per worker and page version.
+    """
+
+    KEY_BASE = f"{RedisBase.NAME_SPACE}page:"
+    TTL = int(environ.get("PAGE_CACHE_TTL", 300))
+    STALE_TTL = 24 * 60 * 60
+    LOCK_TIMEOUT = 30
+    CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
+    UNLOCK_SCRIPT = """
+        if redis.call("GET", KEYS[1]) == ARGV[1] then
+            return redis.call("DEL", KEYS[1])
+        end
+        return 0
+    """
+
+    _lock = threading.Lock()
+    _local = {}
+    _stats = {"fresh": 0, "stale": 0, "miss": 0, "refresh": 0}
+
+    def __init__(self, page, mimetype="text/html"):
+        super().__init__()
+        self.page = page
+        self.mimetype = mimetype
+        self.key = self.KEY_BASE + page
+        self.lock_key = f"{self.key}:lock"
+
+    def get_rendered(self, render):
+        """get cached page, call render() to build missing or stale page"""
+        try:
+            meta, generation = self._get_meta()
+        except redis.exceptions.ConnectionError:
+            print(f"page cache: redis unavailable, render {self.page}")
+            return self._build(render())
+
+        if not meta:
+            self._count("miss")
+            return self._refresh(render, generation)
+
+        is_current = meta["generation"] == generation
+        if is_current and meta["fresh_until"] > time.time():
+            return self._serve_local(
+                meta["version"], "fresh", render, generation
+            )
+
+        token = uuid4().hex
+        if self.conn.set(self.lock_key, token, nx=True, ex=self.LOCK_TIMEOUT):
+            try:
+                return self._refresh(render, generation)
+            except Exception as err:
+                stale = self._get_local(meta["version"])
+                if not stale:
+                    raise
+
+                print(f"page cache: refresh {self.page} failed: {err}")
+                self._count("stale")
+                return stale
+            finally:
+                self._unlock(token)
+
+        return self._serve_local(meta["version"], "stale", render, generation)
+
+    def _serve_local(self, version, outcome, render, generation):
+        """serve stored copy, render again if it expired in the meantime"""
+        rendered = self._get_local(version)
+        if rendered:
+            self._count(outcome)
+            return rendered
+
+        self._count("miss")
+        return self._refresh(render, generation)
+
+    def _unlock(self, token):
+        """release refresh lock only if still held by this request"""
+        unlock = self.conn.register_script(self.UNLOCK_SCRIPT)
+        unlock(keys=[self.lock_key], args=[token])
+
+    def _get_meta(self):
+        """get page metadata and current release generation"""
+        pipe = self.pipeline()
+        pipe.hmget(self.key, ["version", "fresh_until", "generation"])
+        pipe.get(ReleaseCache.GENERATION_KEY)
+        (version, fresh_until, generation), current = pipe.execute()
+        current = int(current) if current else 0
+        if not version:
+            return False, current
+
+        meta = {
+            "version": version.decode(),
+            "fresh_until": float(fresh_until),
+            "generation": int(generation),
+        }
+        return meta, current
+
+    def _refresh(self, render, generation):
+        """render page and share it with all workers"""
+        ReleaseCache().apply_generation(generation)
+        body = render()
+        version = uuid4().hex
+        pipe = self.pipeline(transaction=True)
+        pipe.hset(self.key, mapping={
+            "body": body,
+            "version": version,
+            "fresh_until": time.time() + self.TTL,
+            "generation": generation,
+        })
+        pipe.expire(self.key, self.TTL + self.STALE_TTL)
+        pipe.execute()
+        self._count("refresh")
+
+        rendered = self._build(body)
+        with self._lock:
+            self._local[self.page] = (version, rendered)
+
+        return rendered
+
+    def _get_local(self, version):
+        """get compressed page of this worker, load body on version change
+
+        Returns False if the shared copy expired since reading its meta.
+        """
+        with self._lock:
+            local = self._local.get(self.page)
+
+        if local and local[0] == version:
+            return local[1]
+
+        body = self.conn.hget(self.key, "body")
+        if body is None:
+            return False
+
+        rendered = self._build(body)
+        with self._lock:
+            self._local[self.page] = (version, rendered)
+
+        return rendered
+
+    def _build(self, body):
+        """compress body once"""
+        return RenderedResponse(
+            body, mimetype=self.mimetype, cache_control=self.CACHE_CONTROL
+        )
+
+    def _count(self, outcome):
+        """count cache outcome of this worker"""
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def get_stats(self):
+        """get cache outcomes of this worker"""
+        with self._lock:
+            return self._stats.copy()
@@ -0,0 +1,136 @@
+"""in process cache for release tags"""
+
+import threading
+import time
+
+import redis
+from src.ta_redis import RedisBase
+
+
+class ReleaseCache(RedisBase):
+    """keep hot release tags in memory of each worker
+
+    save_tag bumps a generation counter in redis, every process compares
+    its local generation at most every GENERATION_CHECK seconds and drops
+    its copies when the counter moved.
+    """
+
+    GENERATION_KEY = f"{RedisBase.NAME_SPACE}release:generation"
+    NOTES_KEY = f"{RedisBase.NAME_SPACE}release:notes:"
+    NOTES_TTL = 30 * 24 * 60 * 60
+    TTL = 300
+    GENERATION_CHECK = 2
+    MAX_SIZE = 32
+
+    _lock = threading.Lock()
+    _store = {}
+    _generation = False
+    _generation_checked = 0
+    _stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, tag, part="release"):
+        """return cached release dict or derived part, False on miss"""
+        self._check_generation()
+        with self._lock:
+            entry = self._store.get(tag)
+
+            if not entry or entry["expires"] < time.monotonic():
+                self._stats["misses"] += 1
+                return False
+
+            if part not in entry:
+                return False
+
+            self._stats["hits"] += 1
+
+        return entry[part]
+
+    def set(self, tag, release, generation=False):
+        """store release dict for tag
+
+        Pass the generation read before loading the release, the release
+        is not stored if save_tag moved the generation in the meantime.
+        """
+        if generation is not False:
+            current = self.get_generation()
+            self.apply_generation(current)
+            if current != generation:
+                print(f"release cache: {tag} changed while loading, skip")
+                return
+
+        entry = {
+            "release": release,
+            "expires": time.monotonic() + self.TTL,
+        }
+        with self._lock:
+            if tag not in self._store and len(self._store) >= self.MAX_SIZE:
+                oldest = min(
+                    self._store, key=lambda i: self._store[i]["expires"]
+                )
+                self._store.pop(oldest)
+
+            self._store[tag] = entry
+
+    def set_part(self, tag, part, value):
+        """attach derived value like rendered response to cached release"""
+        with self._lock:
+            entry = self._store.get(tag)
+            if entry:
+                entry[part] = value
+
+    def get_notes(self, version):
+        """get release notes html shared between workers, False on miss"""
+        notes_html = self.conn.get(self.NOTES_KEY + version)
+        if not notes_html:
+            return False
+
+        return notes_html.decode()
+
+    def set_notes(self, version, notes_html):
+        """share rendered release notes html of version"""
+        self.conn.set(self.NOTES_KEY + version, notes_html, ex=self.NOTES_TTL)
+
+    def invalidate(self):
+        """drop local copies and signal all other workers"""
+        self.clear()
+        generation = self.conn.execute_command("INCR", self.GENERATION_KEY)
+        ReleaseCache._generation = int(generation)
+
+    def clear(self):
+        """drop all local copies"""
+        with self._lock:
+            self._store.clear()
+            self._stats["invalidations"] += 1
+
+    def get_stats(self):
+        """return cache metrics of this worker"""
+        with self._lock:
+            stats = self._stats.copy()
+            stats["size"] = len(self._store)
+
+        return stats
+
+    def get_generation(self):
+        """read current generation, local one if redis is unavailable"""
+        try:
+            generation = self.conn.execute_command("GET", self.GENERATION_KEY)
+        except redis.exceptions.ConnectionError:
+            print("release cache: redis unavailable, rely on ttl")
+            return ReleaseCache._generation
+
+        return int(generation) if generation else 0
+
+    def _check_generation(self):
+        """clear store if generation changed since last check"""
+        now = time.monotonic()
+        if now - ReleaseCache._generation_checked < self.GENERATION_CHECK:
+            return
+
+        ReleaseCache._generation_checked = now
+        self.apply_generation(self.get_generation())
+
+    def apply_generation(self, generation):
+        """clear store if generation read from redis moved"""
+        if generation != ReleaseCache._generation:
+            self.clear()
+            ReleaseCache._generation = generation
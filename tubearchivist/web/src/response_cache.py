@@ -0,0 +1,53 @@
+"""serialize and compress response bodies once"""
+
+import gzip
+from hashlib import sha256
+
+import brotli
+from flask import Response
+
+
+class RenderedResponse:
+    """hold body with precompressed encodings and strong etags"""
+
+    ENCODINGS = ["br", "gzip", "identity"]
+    CACHE_CONTROL = "public, max-age=60"
+
+    def __init__(self, body, mimetype="application/json", cache_control=False):
+        if isinstance(body, str):
+            body = body.encode()
+
+        self.mimetype = mimetype
+        self.cache_control = cache_control or self.CACHE_CONTROL
+        self.bodies = {
+            "identity": body,
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+            "br": brotli.compress(body),
+        }
+        digest = sha256(body).hexdigest()[:32]
+        self.etags = {
+            "identity": digest,
+            "gzip": f"{digest}-gzip",
+            "br": f"{digest}-br",
+        }
+
+    def to_response(self, request):
+        """build response for request, 304 on matching If-None-Match"""
+        encoding = request.accept_encodings.best_match(self.ENCODINGS)
+        if not encoding:
+            encoding = "identity"
+
+        if any(request.if_none_match.contains(i) for i in self.etags.values()):
+            response = Response(status=304)
+        else:
+            response = Response(
+                self.bodies[encoding], mimetype=self.mimetype
+            )
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+
+        response.set_etag(self.etags[encoding])
+        response.headers["Cache-Control"] = self.cache_control
+        response.vary.add("Accept-Encoding")
+
+        return response
@@ -0,0 +1,194 @@
+"""serve downsampled time series from the stats tables"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, time as dt_time, timezone
+
+from src.db import DatabaseConnect
+from src.response_cache import RenderedResponse
+
+
+def lttb(points, threshold):
+    """largest triangle three buckets downsampling of (x, y) points"""
+    if threshold >= len(points) or threshold < 3:
+        return points
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    selected = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * bucket_size) + 1
+        avg_end = min(int((i + 2) * bucket_size) + 1, len(points))
+        avg_range = points[avg_start:avg_end]
+        avg_x = sum(j[0] for j in avg_range) / len(avg_range)
+        avg_y = sum(j[1] for j in avg_range) / len(avg_range)
+
+        point_x, point_y = points[selected]
+        max_area = -1
+        for j in range(int(i * bucket_size) + 1, avg_start):
+            area = abs(
+                (point_x - avg_x) * (points[j][1] - point_y)
+                - (point_x - points[j][0]) * (avg_y - point_y)
+            )
+            if area > max_area:
+                max_area = area
+                next_selected = j
+
+        sampled.append(points[next_selected])
+        selected = next_selected
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class StatsSeries:
+    """build cacheable json time series for stats endpoints
+
+    Weekly buckets are labeled by the sunday ending the week, same as the
+    docker stats weekly rollup.
+    """
+
+    RANGES = {"30d": 30, "90d": 90, "1y": 365, "all": False}
+    MAX_POINTS = 1000
+    DEFAULT_POINTS = 300
+    CACHE_TTL = 600
+    CACHE_MAX = 64
+    CACHE_CONTROL = "public, max-age=600"
+
+    QUERIES = {
+        "pulls": {
+            "day": """
+                SELECT day AS bucket, pulls, pulls_delta
+                FROM ta_docker_stats_daily
+                WHERE day >= {since}
+                ORDER BY day;
+            """,
+            "week": """
+                SELECT week AS bucket, pulls, pulls_delta
+                FROM ta_docker_stats_weekly
+                WHERE week >= {since}
+                ORDER BY week;
+            """,
+        },
+        "versions": {
+            "day": """
+                SELECT ping_date AS bucket, SUM(ping_count) AS ping_count
+                FROM ta_version_stats
+                WHERE ping_date >= {since}
+                GROUP BY 1
+                ORDER BY 1;
+            """,
+            "week": """
+                SELECT ping_date + (7 - EXTRACT(ISODOW FROM ping_date))::int
+                    AS bucket,
+                    SUM(ping_count) AS ping_count
+                FROM ta_version_stats
+                WHERE ping_date >= {since}
+                GROUP BY 1
+                ORDER BY 1;
+            """,
+        },
+    }
+
+    _lock = threading.Lock()
+    _cache = OrderedDict()
+
+    def __init__(self, name, args):
+        self.name = name
+        self.range = args.get("range", "1y")
+        self.resolution = args.get("resolution", "day")
+        self.points = args.get("points", self.DEFAULT_POINTS)
+
+    def validate(self):
+        """return error message for invalid query params or False"""
+        if self.range not in self.RANGES:
+            return f"range must be one of {list(self.RANGES)}"
+
+        if self.resolution not in self.QUERIES[self.name]:
+            return f"resolution must be one of {list(self.QUERIES[self.name])}"
+
+        try:
+            self.points = int(self.points)
+        except ValueError:
+            return "points must be an integer"
+
+        if not 3 <= self.points <= self.MAX_POINTS:
+            return f"points must be between 3 and {self.MAX_POINTS}"
+
+        return False
+
+    def get_rendered(self):
+        """get rendered response, cached per query params"""
+        cache_key = (self.name, self.range, self.resolution, self.points)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached and cached["expires"] > time.monotonic():
+                self._cache.move_to_end(cache_key)
+                return cached["rendered"]
+
+        body = json.dumps(self.build(), separators=(",", ":"))
+        rendered = RenderedResponse(
+            body, cache_control=self.CACHE_CONTROL
+        )
+        with self._lock:
+            self._cache[cache_key] = {
+                "rendered": rendered,
+                "expires": time.monotonic() + self.CACHE_TTL,
+            }
+            self._cache.move_to_end(cache_key)
+            self._evict()
+
+        return rendered
+
+    def _evict(self):
+        """drop expired entries and least recently used over CACHE_MAX"""
+        now = time.monotonic()
+        expired = [i for i, j in self._cache.items() if j["expires"] <= now]
+        for cache_key in expired:
+            del self._cache[cache_key]
+
+        while len(self._cache) > self.CACHE_MAX:
+            self._cache.popitem(last=False)
+
+    def build(self):
+        """query rows and downsample every value column"""
+        rows = self._get_rows()
+        stamps = [self._to_epoch(i["bucket"]) for i in rows]
+        columns = [i for i in rows[0] if i != "bucket"] if rows else []
+        series = {}
+        for column in columns:
+            points = [
+                (stamp, int(row[column]))
+                for stamp, row in zip(stamps, rows)
+                if row[column] is not None
+            ]
+            series[column] = [list(i) for i in lttb(points, self.points)]
+
+        return {
+            "range": self.range,
+            "resolution": self.resolution,
+            "series": series,
+        }
+
+    def _get_rows(self):
+        """get rows for range and resolution"""
+        days = self.RANGES[self.range]
+        if days:
+            since = f"CURRENT_DATE - {days}"
+        else:
+            since = "'2022-03-01'"
+
+        query = self.QUERIES[self.name][self.resolution].format(since=since)
+        handler = DatabaseConnect()
+        rows = handler.db_execute(query)
+        handler.db_close()
+
+        return rows
+
+    @staticmethod
+    def _to_epoch(day):
+        """date to utc epoch seconds"""
+        stamp = datetime.combine(day, dt_time.min, tzinfo=timezone.utc)
+        return int(stamp.timestamp())
@@ -1,11 +1,43 @@
 """handle redis interactions"""
 
 import json
+import os
+import socket
+import threading
+import time
 from datetime import datetime
+from uuid import uuid4
 
 import redis
 
 
+class RedisPool:
+    """one shared redis connection pool per process"""
+
+    MAX_CONNECTIONS = 32
+    HEALTH_CHECK_INTERVAL = 30
+
+    _pool = False
+    _pid = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, host, port):
+        """return pool for this process, recreate after fork"""
+        with cls._lock:
+            if not cls._pool or cls._pid != os.getpid():
+                cls._pool = redis.BlockingConnectionPool(
+                    host=host,
+                    port=port,
+                    max_connections=cls.MAX_CONNECTIONS,
+                    socket_keepalive=True,
+                    health_check_interval=cls.HEALTH_CHECK_INTERVAL,
+                )
+                cls._pid = os.getpid()
+
+        return cls._pool
+
+
 class RedisBase:
     """connection base for redis"""
 
@@ -14,54 +46,79 @@ class RedisBase:
     NAME_SPACE = "ta:"
 
     def __init__(self):
-        self.conn = redis.Redis(host=self.REDIS_HOST, port=self.REDIS_PORT)
+        self.conn = redis.Redis(
+            connection_pool=RedisPool.get(self.REDIS_HOST, self.REDIS_PORT)
+        )
+
+    def pipeline(self, transaction=False):
+        """batch multiple commands into one round trip"""
+        return self.conn.pipeline(transaction=transaction)
 
 
 class TaskHandler(RedisBase):
-    """handle buildx task queue"""
+    """add buildx tasks to the builder stream
+
+    Requests of a COALESCE task type wait QUIET_WINDOW seconds in the
+    builder. A newer request of the same repo and task type supersedes
+    the queued one, a build already running is never touched.
+    """
+
+    STREAM = f"{RedisBase.NAME_SPACE}task:stream"
+    LATEST = f"{RedisBase.NAME_SPACE}task:latest"
+    STATS = f"{RedisBase.NAME_SPACE}task:stats"
+    FAILED = f"{RedisBase.NAME_SPACE}task:failed"
+    GROUP = "builder"
+    MAXLEN = 1000
+    COALESCE = ["build_unstable", "rebuild"]
+    QUIET_WINDOW = int(os.environ.get("BUILD_QUIET_WINDOW", 60))
+    ADD_SCRIPT = """
+        local entry_id = redis.call(
+            "XADD", KEYS[1], "MAXLEN", "~", ARGV[1], "*", "task", ARGV[2]
+        )
+        if ARGV[3] ~= "" then
+            redis.call("HSET", KEYS[2], ARGV[3], entry_id)
+        end
+        return entry_id
+    """
 
-    def __init__(self, repo_conf, tag_name=False):
+    def __init__(self, repo_conf, tag_name=False, ref=False, commit=False):
         super().__init__()
-        self.key = self.NAME_SPACE + "task:buildx"
         self.repo_conf = repo_conf
         self.tag_name = tag_name
+        self.ref = ref
+        self.commit = commit
 
     def create_task(self, task_name):
-        """create task"""
-        self.create_queue()
-        self.set_task(task_name)
-        self.set_pub()
-
-    def create_queue(self):
-        """set initial json object for queue"""
-        if self.conn.execute_command(f"EXISTS {self.key}"):
-            print(f"{self.key} already exists")
-            return
-
-        message = {
-            "created": int(datetime.now().strftime("%s")),
-            "tasks": {}
-        }
-        self.conn.execute_command(
-            "JSON.SET", self.key, ".", json.dumps(message)
-        )
+        """append task to stream, consumed by builder consumer group"""
+        task = self.build_task(task_name)
+        if task_name in self.COALESCE:
+            task["coalesce_key"] = f"{task['name']}:{task_name}"
+            task["not_before"] = task["timestamp"] + self.QUIET_WINDOW
 
-    def set_task(self, task_name):
-        """publish new task to queue"""
+        add_task = self.conn.register_script(self.ADD_SCRIPT)
+        entry_id = add_task(
+            keys=[self.STREAM, self.LATEST],
+            args=[self.MAXLEN, json.dumps(task), task.get("coalesce_key", "")],
+        )
+        return entry_id.decode()
 
+    def build_task(self, task_name):
+        """build task dict for builder"""
         user = self.repo_conf.get("gh_user")
         repo = self.repo_conf.get("gh_repo")
-        build_command = self.build_command(task_name)
         task = {
             "timestamp": int(datetime.now().strftime("%s")),
+            "task_name": task_name,
             "clone": f"https://github.com/{user}/{repo}.git",
-            "name": self.repo_conf.get("gh_repo"),
-            "build": build_command,
+            "name": repo,
+            "ref": self.ref,
+            "commit": self.commit,
+            "build": self.build_command(task_name),
         }
         if task_name == "sync_es":
             task.update({"clone": False})
 
-        self.conn.json().set(self.key, f".tasks.{repo}", task)
+        return task
 
     def build_command(self, task_name):
         """return build command"""
@@ -70,7 +127,7 @@ class TaskHandler(RedisBase):
 
         all_commands = self.repo_conf.get(task_name)
 
-        if all(isinstance(i, list) for i in all_commands):
+        if all(isinstance(i, (list, dict)) for i in all_commands):
             to_build_commands = []
             for command in all_commands:
                 to_build_commands.append(self._replace_version(command))
@@ -80,9 +137,453 @@ class TaskHandler(RedisBase):
         return to_build_commands
 
     def _replace_version(self, command):
-        """replace version in str"""
+        """replace version in str, also in run list of graph steps"""
+        if isinstance(command, dict):
+            run = self._replace_version(command["run"])
+            return {**command, "run": run}
+
         return [i.replace("$VERSION", self.tag_name) for i in command]
 
-    def set_pub(self):
-        """set message to pub"""
-        self.conn.publish(self.key, self.repo_conf.get("gh_repo"))
+
+class BuildQueue(RedisBase):
+    """read depth and age of the builder stream"""
+
+    def get_stats(self):
+        """get waiting and pending entries with age of the oldest"""
+        stream = TaskHandler.STREAM
+        try:
+            groups = self.conn.xinfo_groups(stream)
+        except redis.exceptions.ResponseError:
+            return {"waiting": 0, "pending": 0}
+
+        group = next(
+            (i for i in groups if i["name"].decode() == TaskHandler.GROUP),
+            False,
+        )
+        if not group:
+            return {"waiting": self.conn.xlen(stream), "pending": 0}
+
+        last_id = group["last-delivered-id"].decode()
+        waiting = self.conn.xrange(stream, min=f"({last_id}", count=1)
+        pending = self.conn.xpending(stream, TaskHandler.GROUP)
+        saved = self.conn.hget(TaskHandler.STATS, "builds_saved")
+        stats = {
+            "builds_saved": int(saved) if saved else 0,
+            "failed": self.conn.zcard(TaskHandler.FAILED),
+            "waiting": group.get("lag") or 0,
+            "oldest_waiting_seconds": 0,
+            "pending": pending["pending"],
+            "oldest_pending_seconds": 0,
+            "consumers": group["consumers"],
+        }
+        if waiting:
+            stats["oldest_waiting_seconds"] = self._age(waiting[0][0])
+        if pending["pending"]:
+            stats["oldest_pending_seconds"] = self._age(pending["min"])
+
+        return stats
+
+    @staticmethod
+    def _age(entry_id):
+        """seconds since stream entry id was created"""
+        if isinstance(entry_id, bytes):
+            entry_id = entry_id.decode()
+
+        created = int(entry_id.split("-")[0]) / 1000
+        return int(time.time() - created)
+
+
+class BuildHistory(RedisBase):
+    """read state and timings of recent builds recorded by the builder"""
+
+    KEY = f"{RedisBase.NAME_SPACE}build:"
+    RECENT = f"{RedisBase.NAME_SPACE}builds"
+    TEXT_FIELDS = ["repo", "task_name", "commit", "state", "error", "task"]
+
+    def get_recent(self, limit=50):
+        """get newest builds first"""
+        entry_ids = [
+            i.decode() for i in self.conn.zrevrange(self.RECENT, 0, limit - 1)
+        ]
+        pipe = self.pipeline()
+        for entry_id in entry_ids:
+            pipe.hgetall(self.KEY + entry_id)
+
+        builds = []
+        for entry_id, record in zip(entry_ids, pipe.execute()):
+            if record:
+                builds.append(self._parse(entry_id, record))
+
+        return builds
+
+    def _parse(self, entry_id, record):
+        """decode record, group step timings"""
+        build = {"entry_id": entry_id, "steps": {}}
+        for key, value in record.items():
+            key, value = key.decode(), value.decode()
+            if key in self.TEXT_FIELDS:
+                build[key] = value
+            elif key.startswith("step:"):
+                build["steps"][key.split(":", 1)[1]] = float(value)
+            else:
+                build[key] = float(value)
+
+        return build
+
+
+class HookQueue(RedisBase):
+    """persist incoming webhooks for background processing"""
+
+    QUEUE = f"{RedisBase.NAME_SPACE}hooks:queue"
+    PROCESSING = f"{RedisBase.NAME_SPACE}hooks:processing"
+    INFLIGHT = f"{RedisBase.NAME_SPACE}hooks:inflight"
+    DELAYED = f"{RedisBase.NAME_SPACE}hooks:delayed"
+    DEAD = f"{RedisBase.NAME_SPACE}hooks:dead"
+    STATS = f"{RedisBase.NAME_SPACE}hooks:stats"
+    MAX_ATTEMPTS = 5
+    BACKOFF_BASE = 10
+    BACKOFF_MAX = 600
+    STALE_AFTER = 600
+    DEAD_MAX = 500
+    TRACK_SCRIPT = """
+        for _, raw in ipairs(redis.call("LRANGE", KEYS[1], 0, -1)) do
+            redis.call("ZADD", KEYS[2], "NX", ARGV[1], raw)
+        end
+    """
+    REQUEUE_SCRIPT = """
+        local requeued = 0
+        local stale = redis.call("ZRANGEBYSCORE", KEYS[2], "-inf", ARGV[1])
+        for _, raw in ipairs(stale) do
+            redis.call("ZREM", KEYS[2], raw)
+            if redis.call("LREM", KEYS[1], 1, raw) > 0 then
+                redis.call("LPUSH", KEYS[3], raw)
+                requeued = requeued + 1
+            end
+        end
+        return requeued
+    """
+
+    def enqueue(self, source, hook):
+        """add new hook to queue"""
+        job = {
+            "id": uuid4().hex,
+            "source": source,
+            "hook": hook,
+            "enqueued": time.time(),
+            "attempts": 0,
+        }
+        self.conn.lpush(self.QUEUE, json.dumps(job))
+        return job["id"]
+
+    def dequeue(self, timeout):
+        """block until next job, keep it in processing list until done"""
+        raw = self.conn.blmove(
+            self.QUEUE, self.PROCESSING, timeout, src="RIGHT", dest="LEFT"
+        )
+        if not raw:
+            return False, False
+
+        self.conn.zadd(self.INFLIGHT, {raw: time.time()})
+        return raw, json.loads(raw)
+
+    def track_processing(self):
+        """track processing jobs missing in inflight set
+
+        Covers a crash between BLMOVE and ZADD in dequeue, NX keeps the
+        start time of jobs already tracked. Runs as one script so a job
+        finished in between is not tracked again.
+        """
+        track = self.conn.register_script(self.TRACK_SCRIPT)
+        track(keys=[self.PROCESSING, self.INFLIGHT], args=[time.time()])
+
+    def done(self, raw, job, started):
+        """remove finished job and record timings"""
+        queue_seconds = started - job["enqueued"]
+        processing_seconds = time.time() - started
+        pipe = self.pipeline(transaction=True)
+        self._remove_processing(pipe, raw)
+        pipe.hincrby(self.STATS, "processed", 1)
+        pipe.hincrbyfloat(self.STATS, "queue_seconds", queue_seconds)
+        pipe.hincrbyfloat(self.STATS, "processing_seconds", processing_seconds)
+        pipe.execute()
+
+    def retry(self, raw, job, error):
+        """schedule retry with exponential backoff or move to dead list"""
+        job["attempts"] += 1
+        job["error"] = error
+        pipe = self.pipeline(transaction=True)
+        self._remove_processing(pipe, raw)
+        if job["attempts"] >= self.MAX_ATTEMPTS:
+            pipe.lpush(self.DEAD, json.dumps(job))
+            pipe.ltrim(self.DEAD, 0, self.DEAD_MAX - 1)
+            pipe.hincrby(self.STATS, "dead", 1)
+        else:
+            backoff = min(
+                self.BACKOFF_BASE * 2 ** (job["attempts"] - 1),
+                self.BACKOFF_MAX,
+            )
+            pipe.zadd(self.DELAYED, {json.dumps(job): time.time() + backoff})
+            pipe.hincrby(self.STATS, "retries", 1)
+
+        pipe.execute()
+
+    def promote_due(self):
+        """move due retries and stale processing jobs back to queue"""
+        self.track_processing()
+        now = time.time()
+        for raw in self.conn.zrangebyscore(self.DELAYED, "-inf", now):
+            if self.conn.zrem(self.DELAYED, raw):
+                self.conn.lpush(self.QUEUE, raw)
+
+        requeue = self.conn.register_script(self.REQUEUE_SCRIPT)
+        requeued = requeue(
+            keys=[self.PROCESSING, self.INFLIGHT, self.QUEUE],
+            args=[now - self.STALE_AFTER],
+        )
+        if requeued:
+            print(f"requeued {requeued} stale hook jobs")
+
+    def _remove_processing(self, pipe, raw):
+        """remove job from processing list and inflight set"""
+        pipe.lrem(self.PROCESSING, 1, raw)
+        pipe.zrem(self.INFLIGHT, raw)
+
+    def get_stats(self):
+        """get queue depth and cumulative timings"""
+        stats = {
+            i.decode(): float(j)
+            for i, j in self.conn.hgetall(self.STATS).items()
+        }
+        processed = stats.get("processed")
+        if processed:
+            stats["avg_queue_seconds"] = stats["queue_seconds"] / processed
+            stats["avg_processing_seconds"] = (
+                stats["processing_seconds"] / processed
+            )
+
+        stats.update({
+            "queued": self.conn.llen(self.QUEUE),
+            "processing": self.conn.llen(self.PROCESSING),
+            "delayed": self.conn.zcard(self.DELAYED),
+            "dead_letter": self.conn.llen(self.DEAD),
+        })
+        return stats
+
+
+class HookSteps(RedisBase):
+    """remember side effects of a hook job that already completed
+
+    A retried job skips steps done in earlier attempts, so a failure
+    late in a handler doesn't repeat builds or notifications.
+    """
+
+    KEY_BASE = f"{RedisBase.NAME_SPACE}hooks:steps"
+    TTL = 24 * 60 * 60
+
+    def __init__(self, job_id):
+        super().__init__()
+        self.key = f"{self.KEY_BASE}:{job_id}"
+
+    def run(self, step, func, *args):
+        """call func once per job, skip if done in earlier attempt"""
+        if self.conn.sismember(self.key, step):
+            print(f"hook step {step} done in earlier attempt, skip")
+            return False
+
+        result = func(*args)
+        pipe = self.pipeline(transaction=True)
+        pipe.sadd(self.key, step)
+        pipe.expire(self.key, self.TTL)
+        pipe.execute()
+        return result
+
+
+class HookDedup(RedisBase):
+    """remember recent hook deliveries in bounded sorted set"""
+
+    SEEN = f"{RedisBase.NAME_SPACE}hooks:seen"
+    STATS = f"{RedisBase.NAME_SPACE}hooks:dedup"
+    TTL = 24 * 60 * 60
+    MAX_SIZE = 10000
+
+    def is_duplicate(self, delivery_id):
+        """mark delivery as seen, return True if seen before"""
+        now = time.time()
+        pipe = self.pipeline(transaction=True)
+        pipe.zremrangebyscore(self.SEEN, "-inf", now - self.TTL)
+        pipe.zadd(self.SEEN, {delivery_id: now}, nx=True)
+        pipe.zremrangebyrank(self.SEEN, 0, -self.MAX_SIZE - 1)
+        pipe.expire(self.SEEN, self.TTL)
+        _, added, _, _ = pipe.execute()
+
+        duplicate = not added
+        self.conn.hincrby(self.STATS, "hits" if duplicate else "misses", 1)
+        return duplicate
+
+    def forget(self, delivery_id):
+        """unmark delivery, so a redelivery gets processed"""
+        self.conn.zrem(self.SEEN, delivery_id)
+
+    def get_stats(self):
+        """get hit and miss counts"""
+        stats = {
+            i.decode(): int(j)
+            for i, j in self.conn.hgetall(self.STATS).items()
+        }
+        stats["size"] = self.conn.zcard(self.SEEN)
+        return stats
+
+
+class ScheduledJob(RedisBase):
+    """run a scheduler job only once across all workers and hosts
+
+    Every worker fires the job, the first to take the slot lock runs it and
+    renews the short lock while running. The others stand by until the slot
+    has an outcome, if the lock expires before that, the running worker
+    died and a standby takes over.
+    """
+
+    LOCK_TTL = 60
+    CLAIM_SCRIPT = """
+        if redis.call("EXISTS", KEYS[2]) == 1 then
+            return 0
+        end
+        if redis.call("SET", KEYS[1], ARGV[1], "NX", "EX", ARGV[2]) then
+            return 1
+        end
+        return 0
+    """
+    RENEW_SCRIPT = """
+        if redis.call("GET", KEYS[1]) == ARGV[1] then
+            return redis.call("EXPIRE", KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    RELEASE_SCRIPT = """
+        if redis.call("GET", KEYS[1]) == ARGV[1] then
+            return redis.call("DEL", KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, job_name, slot_seconds):
+        super().__init__()
+        self.job_name = job_name
+        self.slot_seconds = slot_seconds
+        self.status_key = f"{self.NAME_SPACE}scheduler:status:{job_name}"
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex}"
+
+    def run(self, func):
+        """run func once in current slot, take over if the runner died"""
+        slot = int(time.time()) // self.slot_seconds
+        while not self._claim(slot):
+            if self._get_outcome(slot):
+                return
+
+            time.sleep(self.LOCK_TTL / 2)
+            if int(time.time()) // self.slot_seconds != slot:
+                print(f"{self.job_name}: slot {slot} passed without outcome")
+                return
+
+        self._run_locked(slot, func)
+
+    def _run_locked(self, slot, func):
+        """run func while renewing slot lock, record outcome of slot"""
+        previous = self.get_status()
+        if previous.get("slot") == str(slot):
+            print(f"{self.job_name}: take over from {previous.get('owner')}")
+
+        stop = threading.Event()
+        renewer = threading.Thread(
+            target=self._renew_loop, args=(slot, stop), daemon=True
+        )
+        renewer.start()
+        started = time.time()
+        self._set_status(slot, started, "running")
+        try:
+            func()
+        except Exception as err:
+            self._finish(slot, started, "failed", error=repr(err))
+            raise
+        finally:
+            stop.set()
+
+        self._finish(slot, started, "success")
+
+    def _claim(self, slot):
+        """take slot lock unless the slot already has an outcome"""
+        claim = self.conn.register_script(self.CLAIM_SCRIPT)
+        return claim(
+            keys=[self._lock_key(slot), self._outcome_key(slot)],
+            args=[self.owner, self.LOCK_TTL],
+        )
+
+    def _renew_loop(self, slot, stop):
+        """extend slot lock until stopped"""
+        renew = self.conn.register_script(self.RENEW_SCRIPT)
+        while not stop.wait(self.LOCK_TTL / 3):
+            try:
+                renewed = renew(
+                    keys=[self._lock_key(slot)],
+                    args=[self.owner, self.LOCK_TTL],
+                )
+            except redis.exceptions.RedisError as err:
+                print(f"{self.job_name}: failed to renew lock: {err}")
+                continue
+
+            if not renewed:
+                print(f"{self.job_name}: lost lock of slot {slot}")
+
+    def _finish(self, slot, started, outcome, error=""):
+        """record outcome of slot, then release the lock"""
+        self.conn.set(
+            self._outcome_key(slot), outcome, ex=self.slot_seconds
+        )
+        self._set_status(slot, started, outcome, error=error)
+        release = self.conn.register_script(self.RELEASE_SCRIPT)
+        release(keys=[self._lock_key(slot)], args=[self.owner])
+
+    def _get_outcome(self, slot):
+        """get success or failed of slot, None while not finished"""
+        return self.conn.get(self._outcome_key(slot))
+
+    def _lock_key(self, slot):
+        """lock held by the worker running the slot"""
+        return f"{self.NAME_SPACE}scheduler:lock:{self.job_name}:{slot}"
+
+    def _outcome_key(self, slot):
+        """outcome of the slot, expires with the slot"""
+        return f"{self.NAME_SPACE}scheduler:outcome:{self.job_name}:{slot}"
+
+    def _set_status(self, slot, started, outcome, error=""):
+        """record last run of job"""
+        status = {
+            "slot": slot,
+            "last_run": int(started),
+            "duration": round(time.time() - started, 3),
+            "outcome": outcome,
+            "owner": self.owner,
+            "error": error,
+        }
+        self.conn.hset(self.status_key, mapping=status)
+
+    def get_status(self):
+        """get last run of job, running without lock is abandoned"""
+        status = self.conn.hgetall(self.status_key)
+        status = {i.decode(): j.decode() for i, j in status.items()}
+        is_running = status.get("outcome") == "running"
+        if is_running and not self.conn.exists(
+            self._lock_key(status.get("slot"))
+        ):
+            status["outcome"] = "abandoned"
+
+        return status
+
+
+def single_run(job_name, func, slot_seconds):
+    """wrap func for scheduler to run once per slot across workers"""
+    def run_job():
+        ScheduledJob(job_name, slot_seconds).run(func)
+
+    run_job.__name__ = job_name
+    return run_job
@@ -1,7 +1,13 @@
 """increment and archive version check requests"""
 
+import atexit
+import os
+import re
+import threading
 from datetime import datetime
+from uuid import uuid4
 
+import redis
 from src.db import DatabaseConnect
 from src.ta_redis import RedisBase
 from src.webhook_github import GithubBackup
@@ -11,66 +17,219 @@ class VersionCheckCounter(RedisBase):
     """count requests to version check API endpoint"""
 
     KEY_BASE = f"{RedisBase.NAME_SPACE}versioncounter"
+    BATCH_BASE = f"{RedisBase.NAME_SPACE}versionarchive"
     TABLE = "ta_version_stats"
+    BATCH_TABLE = "ta_version_archive_batch"
+    FLUSH_SIZE = 50
+    FLUSH_INTERVAL = 10
+    SCAN_COUNT = 500
+    BATCH_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+    FLUSH_BASE = f"{RedisBase.NAME_SPACE}versionflush"
+    FLUSH_MARKER_TTL = 60 * 60
+    STAGE_SCRIPT = """
+        for i = 2, #KEYS do
+            local count = redis.call("GET", KEYS[i])
+            if count then
+                redis.call("HINCRBY", KEYS[1], ARGV[i - 1], count)
+                redis.call("DEL", KEYS[i])
+            end
+        end
+        return redis.call("HLEN", KEYS[1])
+    """
+    FLUSH_SCRIPT = """
+        if not redis.call("SET", KEYS[1], 1, "NX", "EX", ARGV[1]) then
+            return 0
+        end
+        for i = 2, #KEYS do
+            redis.call("INCRBY", KEYS[i], ARGV[i])
+        end
+        return 1
+    """
+
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _flush_event = threading.Event()
+    _pending = {}
+    _pending_count = 0
+    _unacked = []
+    _flusher_pid = False
 
     def __init__(self):
         super().__init__()
         self.timestamp = datetime.now().strftime("%Y%m%d")
         self.key = f"{self.KEY_BASE}:{self.timestamp}"
-        self.query = False
 
     def increase(self):
-        """increase counter by one"""
-        self.conn.execute_command("INCR", self.key)
+        """increase counter by one, written to redis in batches"""
+        cls = VersionCheckCounter
+        with cls._lock:
+            cls._pending[self.key] = cls._pending.get(self.key, 0) + 1
+            cls._pending_count += 1
+            flush_due = cls._pending_count >= self.FLUSH_SIZE
+            start_flusher = cls._flusher_pid != os.getpid()
+            if start_flusher:
+                cls._flusher_pid = os.getpid()
+
+        if start_flusher:
+            self._start_flusher()
+
+        if flush_due:
+            cls._flush_event.set()
+
+    def flush(self):
+        """write pending counts of this worker to redis
+
+        Every batch gets a flush id, written atomically with the counts.
+        A batch is kept after a failed write and sent again with the same
+        id, so a write applied by redis with the reply lost on the way
+        back is not counted twice.
+        """
+        cls = VersionCheckCounter
+        with cls._flush_lock:
+            with cls._lock:
+                pending, cls._pending = cls._pending, {}
+                cls._pending_count = 0
+                batches, cls._unacked = cls._unacked, []
+
+            if pending:
+                batches.append((uuid4().hex, pending))
+
+            for idx, (flush_id, counts) in enumerate(batches):
+                try:
+                    self._write_batch(flush_id, counts)
+                except redis.exceptions.RedisError as err:
+                    print(f"version counter flush failed, keep pending: {err}")
+                    with cls._lock:
+                        cls._unacked = batches[idx:] + cls._unacked
+                    return
+
+    def _write_batch(self, flush_id, counts):
+        """increase counters unless flush id was already applied"""
+        keys = list(counts)
+        write = self.conn.register_script(self.FLUSH_SCRIPT)
+        applied = write(
+            keys=[f"{self.FLUSH_BASE}:{flush_id}"] + keys,
+            args=[self.FLUSH_MARKER_TTL] + [counts[i] for i in keys],
+        )
+        if not applied:
+            print(f"{flush_id}: version counts already written")
+
+    def _start_flusher(self):
+        """flush on size or time threshold from background thread"""
+        cls = VersionCheckCounter
+
+        def flush_loop():
+            while True:
+                cls._flush_event.wait(self.FLUSH_INTERVAL)
+                cls._flush_event.clear()
+                VersionCheckCounter().flush()
+
+        thread = threading.Thread(
+            target=flush_loop, name="version-counter-flush", daemon=True
+        )
+        thread.start()
 
     def archive(self):
-        """archive past counters to pg"""
-        counters = self.conn.execute_command("KEYS", f"{self.KEY_BASE}:*")
-        archive_keys = [i.decode() for i in counters if i.decode() != self.key]
-        archive_keys.sort()
-        if not archive_keys:
+        """archive past counters to pg, one transaction per staged batch
+
+        Counters are first moved atomically into a staging hash named by
+        batch id. The batch id is committed together with the rows, the
+        staging hash is deleted only after that, a batch left over from
+        an interrupted run is inserted or just deleted on the next run.
+        """
+        self.flush()
+        self._stage_counters()
+        batch_keys = sorted(self._scan(f"{self.BATCH_BASE}:*"))
+        if not batch_keys:
             print("no new version keys to archive")
             return
 
-        for archive_key in archive_keys:
-            self._build_query(archive_key)
-            self._insert_line()
-            self._delete_key(archive_key)
-
-    def _build_query(self, archive_key):
-        """store single archive key in pg"""
-        stats = {
-            "ping_date": archive_key.lstrip(self.KEY_BASE),
-            "ping_count": self._get_count(archive_key),
-            "latest_version": self._get_latest_version(),
-        }
-        keys = stats.keys()
-        values = tuple(stats.values())
-        keys_str = ", ".join(keys)
-        valid = ", ".join(["%s" for i in keys])
-        self.query = (
-            f"INSERT INTO {self.TABLE} ({keys_str}) VALUES ({valid});", values
+        latest_version = self._get_latest_version()
+        for batch_key in batch_keys:
+            self._archive_batch(batch_key, latest_version)
+
+    def _stage_counters(self):
+        """move all past counters into a new staging batch"""
+        archive_keys = sorted(
+            i for i in self._scan(f"{self.KEY_BASE}:*") if i != self.key
+        )
+        if not archive_keys:
+            return
+
+        batch_key = f"{self.BATCH_BASE}:{uuid4().hex}"
+        stage = self.conn.register_script(self.STAGE_SCRIPT)
+        stage(
+            keys=[batch_key] + archive_keys,
+            args=[i.split(":")[-1] for i in archive_keys],
         )
 
-    def _get_count(self, archive_key):
-        """get count from redis"""
-        result = self.conn.execute_command("GET", archive_key)
-        return int(result.decode())
+    def _scan(self, match):
+        """iterate keys without blocking redis"""
+        keys = self.conn.scan_iter(match=match, count=self.SCAN_COUNT)
+        return [i.decode() for i in keys]
+
+    def _archive_batch(self, batch_key, latest_version):
+        """insert staged batch unless already committed, then drop it"""
+        batch_id = batch_key.split(":")[-1]
+        if not self.BATCH_ID_PATTERN.match(batch_id):
+            print(f"{batch_key}: invalid batch id, skip")
+            return
+
+        counts = {
+            i.decode(): int(j)
+            for i, j in self.conn.hgetall(batch_key).items()
+        }
+        if self._is_archived(batch_id):
+            print(f"{batch_id}: already archived, remove staging")
+        elif counts:
+            self._insert_batch(batch_id, counts, latest_version)
+
+        self.conn.delete(batch_key)
+
+    def _is_archived(self, batch_id):
+        """check for batch marker in pg"""
+        handler = DatabaseConnect()
+        rows = handler.db_execute((
+            f"SELECT batch_id FROM {self.BATCH_TABLE} WHERE batch_id = %s;",
+            (batch_id,),
+        ))
+        handler.db_close()
+        return bool(rows)
+
+    def _insert_batch(self, batch_id, counts, latest_version):
+        """insert all rows and batch marker in one transaction"""
+        rows = [
+            (ping_date, ping_count, latest_version)
+            for ping_date, ping_count in sorted(counts.items())
+        ]
+        valid = ", ".join(["(%s, %s, %s)"] * len(rows))
+        values = tuple(i for row in rows for i in row)
+        handler = DatabaseConnect()
+        handler.db_execute((
+            f"INSERT INTO {self.TABLE} "
+            + f"(ping_date, ping_count, latest_version) VALUES {valid};",
+            values,
+        ))
+        handler.db_execute((
+            f"INSERT INTO {self.BATCH_TABLE} (batch_id, row_count) "
+            + "VALUES (%s, %s);",
+            (batch_id, len(rows)),
+        ))
+        handler.db_close()
+        print(f"{batch_id}: archived {len(rows)} days")
 
     def _get_latest_version(self):
         """get semantic release of latest"""
         latest = GithubBackup("latest").get_tag().get("release_version")
         return latest
 
-    def _insert_line(self):
-        """add line to postgres"""
-        handler = DatabaseConnect()
-        handler.db_execute(self.query)
-        handler.db_close()
 
-    def _delete_key(self, archive_key):
-        """delete archived key from redis"""
-        self.conn.execute_command("DEL", archive_key)
+def flush_version_counter():
+    """final flush on worker shutdown"""
+    VersionCheckCounter().flush()
+
+
+atexit.register(flush_version_counter)
 
 
 def run_version_check_archive():
@@ -25,11 +25,11 @@ class WebhookBase:
                 "-t", "bbilly1/tubearchivist:$VERSION", "--push"
             ],
             "sync_es": [
-                ["docker", "image", "pull", "docker.elastic.co/elasticsearch/elasticsearch:$VERSION"],
-                ["docker", "tag", "docker.elastic.co/elasticsearch/elasticsearch:$VERSION", "bbilly1/tubearchivist-es"],
-                ["docker", "tag", "docker.elastic.co/elasticsearch/elasticsearch:$VERSION", "bbilly1/tubearchivist-es:$VERSION"],
-                ["docker", "push", "bbilly1/tubearchivist-es"],
-                ["docker", "push", "bbilly1/tubearchivist-es:$VERSION"],
+                {"id": "pull", "run": ["docker", "image", "pull", "docker.elastic.co/elasticsearch/elasticsearch:$VERSION"]},
+                {"id": "tag_latest", "needs": ["pull"], "run": ["docker", "tag", "docker.elastic.co/elasticsearch/elasticsearch:$VERSION", "bbilly1/tubearchivist-es"]},
+                {"id": "tag_version", "needs": ["pull"], "run": ["docker", "tag", "docker.elastic.co/elasticsearch/elasticsearch:$VERSION", "bbilly1/tubearchivist-es:$VERSION"]},
+                {"id": "push_latest", "needs": ["tag_latest"], "run": ["docker", "push", "bbilly1/tubearchivist-es"]},
+                {"id": "push_version", "needs": ["tag_version"], "run": ["docker", "push", "bbilly1/tubearchivist-es:$VERSION"]},
             ],
             "discord_unstable_hook": environ.get("DOCKER_UNSTABLE_HOOK_URL"),
             "discord_release_hook": environ.get("GITHUB_RELEASE_HOOK_URL"),
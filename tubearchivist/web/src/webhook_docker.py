@@ -2,18 +2,19 @@
 
 import json
 from datetime import datetime
+from hashlib import sha256
 
-import requests
+from src.http_client import ConditionalCache, HttpClient
 from src.webhook_base import WebhookBase
 
 
 class DockerHook(WebhookBase):
     """parse docker webhook and forward to discord"""
 
-    def __init__(self, request):
+    def __init__(self, request=False, hook=False):
         self.request = request
         self.name = False
-        self.hook = False
+        self.hook = hook
         self.repo_conf = False
         self.tag = False
 
@@ -25,6 +26,10 @@ class DockerHook(WebhookBase):
 
         return received == self.DOCKER_HOOK_SECRET
 
+    def delivery_id(self):
+        """docker hub has no delivery id, use payload hash"""
+        return f"docker:{sha256(self.request.data).hexdigest()}"
+
     def process(self):
         """process the hook data"""
 
@@ -55,7 +60,6 @@ class DockerHook(WebhookBase):
 
     def _parse_hook(self):
         """parse hook json"""
-        self.hook = self.request.json
         self.tag = self.hook["push_data"]["tag"]
         if not self.tag or self.tag == "latest":
             return False
@@ -74,16 +78,25 @@ class DockerHook(WebhookBase):
         user = self.repo_conf.get("gh_user")
         repo = self.repo_conf.get("gh_repo")
         url = f"https://api.github.com/repos/{user}/{repo}/commits/master"
-        response = requests.get(url, timeout=20).json()
-        commit_url = response["html_url"]
-        first_line_message = response["commit"]["message"].split("\n")[0]
+        commit_url, first_line_message = ConditionalCache().get(
+            url, self._extract_commit
+        )
 
         return commit_url, first_line_message
 
+    @staticmethod
+    def _extract_commit(response):
+        """extract url and first message line from commit response"""
+        response_json = response.json()
+        commit_url = response_json["html_url"]
+        first_line_message = response_json["commit"]["message"].split("\n")[0]
+
+        return [commit_url, first_line_message]
+
     @staticmethod
     def _forward_message(message_data, url):
         """forward message to discrod"""
-        response = requests.post(url, json=message_data, timeout=20)
+        response = HttpClient().post(url, json=message_data)
         if not response.ok:
             print(response.json())
             return {"success": False}
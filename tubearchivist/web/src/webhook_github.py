@@ -7,10 +7,12 @@ from hashlib import sha256, md5
 from hmac import HMAC, compare_digest
 from os import environ
 
+import markdown
 from bs4 import BeautifulSoup
-import requests
-
 from src.db import DatabaseConnect
+from src.http_client import ConditionalCache, HttpClient
+from src.release_cache import ReleaseCache
+from src.response_cache import RenderedResponse
 from src.ta_redis import TaskHandler
 from src.webhook_base import WebhookBase
 
@@ -28,9 +30,10 @@ HOOK_URL = {
 class GithubHook(WebhookBase):
     """process hooks from github"""
 
-    def __init__(self, request):
+    def __init__(self, request=False, hook=False, steps=False):
         self.request = request
-        self.hook = False
+        self.hook = hook
+        self.steps = steps
         self.repo = False
         self.repo_conf = False
 
@@ -48,9 +51,16 @@ class GithubHook(WebhookBase):
         print(f"expected: {expected}")
         return compare_digest(received, expected)
 
+    def delivery_id(self):
+        """unique id of delivery, same for redeliveries"""
+        delivery = self.request.headers.get("X-GitHub-Delivery")
+        if delivery:
+            return f"github:{delivery}"
+
+        return f"github:{sha256(self.request.data).hexdigest()}"
+
     def create_hook_task(self):
         """check what task is required"""
-        self.hook = self.request.json
         self.repo = self.hook["repository"]["name"]
 
         if self.repo not in self.HOOK_MAP:
@@ -67,10 +77,17 @@ class GithubHook(WebhookBase):
             self.process_release_hook()
 
         if "pull_request" in self.hook or "issue" in self.hook:
-            CommentNotification(self.hook).run()
+            self._run_step("comment", CommentNotification(self.hook).run)
 
         return False
 
+    def _run_step(self, step, func, *args):
+        """run side effect once per queued job"""
+        if not self.steps:
+            return func(*args)
+
+        return self.steps.run(step, func, *args)
+
     def process_commit_hook(self):
         """process commit hook after validation"""
         on_master = self.check_branch()
@@ -78,8 +95,11 @@ class GithubHook(WebhookBase):
             print("commit not on master")
             return
 
+        task = TaskHandler(
+            self.repo_conf, ref=self.hook["ref"], commit=self.hook["after"]
+        )
         if self.repo in ["docs", "discord-bot"]:
-            TaskHandler(self.repo_conf).create_task("rebuild")
+            self._run_step("rebuild", task.create_task, "rebuild")
             return
 
         if self.repo != "tubearchivist":
@@ -92,7 +112,7 @@ class GithubHook(WebhookBase):
             return
 
         self.repo = self.hook["repository"]["name"]
-        TaskHandler(self.repo_conf).create_task("build_unstable")
+        self._run_step("build_unstable", task.create_task, "build_unstable")
 
     def check_branch(self):
         """check if commit on master branch"""
@@ -110,10 +130,11 @@ class GithubHook(WebhookBase):
         for i in modified:
             if "README.md" in i:
                 print("README updated, check roadmap")
-                RoadmapHook(self.repo_conf, self.ROADMAP_HOOK_URL).update()
+                roadmap = RoadmapHook(self.repo_conf, self.ROADMAP_HOOK_URL)
+                self._run_step("roadmap", roadmap.update)
             if "docker-compose.yml" in i:
                 print("docker-compose updated, check es version")
-                EsVersionSync(self.repo_conf).run()
+                self._run_step("es_sync", EsVersionSync(self.repo_conf).run)
 
     def process_release_hook(self):
         """build and process for new release"""
@@ -125,10 +146,12 @@ class GithubHook(WebhookBase):
             print("no build_release command")
             return
 
-        task = TaskHandler(self.repo_conf, tag_name=tag_name)
-        task.create_task("build_release")
+        task = TaskHandler(
+            self.repo_conf, tag_name=tag_name, ref=f"refs/tags/{tag_name}"
+        )
+        self._run_step("build_release", task.create_task, "build_release")
         if self.repo == "tubearchivist":
-            GithubBackup(tag_name).save_tag()
+            self._run_step("save_tag", GithubBackup(tag_name).save_tag)
 
     def save_hook(self):
         """save hook to disk for easy debugging"""
@@ -289,8 +312,8 @@ class CommentNotification:
             print(f"{self.repo} not found in HOOK_URL")
             return
 
-        response = requests.post(
-            f"{url}?wait=true", json=hook_data, timeout=10
+        response = HttpClient().post(
+            f"{url}?wait=true", json=hook_data
         )
         if not response.ok:
             print(response.json())
@@ -314,17 +337,60 @@ class GithubBackup:
         _ = self.db_execute()
         self._build_ingest_query()
         _ = self.db_execute()
+        cache = ReleaseCache()
+        cache.set_notes(
+            self.ingest_line["release_version"],
+            markdown.markdown(self.ingest_line["release_notes"]),
+        )
+        cache.invalidate()
 
     def get_tag(self):
-        """get tag dict"""
+        """get tag dict, served from release cache when hot"""
+        cache = ReleaseCache()
+        cached = cache.get(self.tag)
+        if cached:
+            return cached
+
+        generation = cache.get_generation()
         self.build_get_query()
         rows = self.db_execute()
         result = dict(rows[0])
+        cache.set(self.tag, result, generation=generation)
         return result
 
+    def get_rendered(self):
+        """get tag as serialized and compressed json response"""
+        release = self.get_tag()
+        cache = ReleaseCache()
+        rendered = cache.get(self.tag, part="rendered")
+        if rendered:
+            return rendered
+
+        body = json.dumps(release, sort_keys=True, separators=(",", ":"))
+        rendered = RenderedResponse(body + "\n")
+        cache.set_part(self.tag, "rendered", rendered)
+        return rendered
+
+    def get_notes_html(self):
+        """get release notes as html, rendered once per release version"""
+        release = self.get_tag()
+        cache = ReleaseCache()
+        notes_html = cache.get(self.tag, part="notes_html")
+        if notes_html:
+            return notes_html
+
+        version = release["release_version"]
+        notes_html = cache.get_notes(version)
+        if not notes_html:
+            notes_html = markdown.markdown(release["release_notes"])
+            cache.set_notes(version, notes_html)
+
+        cache.set_part(self.tag, "notes_html", notes_html)
+        return notes_html
+
     def ingest_build_line(self):
         """ingest latest release into postgres"""
-        response = requests.get(self.URL + self.tag, timeout=10)
+        response = HttpClient().get(self.URL + self.tag)
         if not response.ok:
             print(response.text)
             raise ValueError
@@ -440,17 +506,18 @@ class RoadmapHook:
         user = self.repo_conf.get("gh_user")
         repo = self.repo_conf.get("gh_repo")
         url = f"https://api.github.com/repos/{user}/{repo}/contents/README.md"
-        response = requests.get(url, timeout=10).json()
-        content = base64.b64decode(response["content"]).decode()
+        self.roadmap_raw = ConditionalCache().get(url, self._extract_roadmap)
+
+    @staticmethod
+    def _extract_roadmap(response):
+        """extract roadmap paragraph from readme response"""
+        content = base64.b64decode(response.json()["content"]).decode()
         paragraphs = [i.strip() for i in content.split("##")]
         for paragraph in paragraphs:
             if paragraph.startswith("Roadmap"):
-                roadmap_raw = paragraph
-                break
-        else:
-            roadmap_raw = False
+                return paragraph
 
-        self.roadmap_raw = roadmap_raw
+        return False
 
     def parse_roadmap(self):
         """extract relevant information"""
@@ -468,7 +535,7 @@ class RoadmapHook:
     def delete_webhook(self, message_id):
         """delete old message"""
         url = f"{self.hook_url}/messages/{message_id}"
-        response = requests.delete(url, timeout=10)
+        response = HttpClient().delete(url)
         print(response)
 
     def send_message(self):
@@ -484,8 +551,8 @@ class RoadmapHook:
                 "color": 10555
             }]
         }
-        response = requests.post(
-            f"{self.hook_url}?wait=true", json=data, timeout=10
+        response = HttpClient().post(
+            f"{self.hook_url}?wait=true", json=data
         )
         print(response)
         print(response.text)
@@ -539,19 +606,30 @@ class EsVersionSync:
 
     def get_expected(self):
         """get expected es version from readme"""
-        response = requests.get(self.COMPOSE, timeout=10).json()
-        content = base64.b64decode(response["content"]).decode()
+        self.expected = ConditionalCache().get(
+            self.COMPOSE, self._extract_expected
+        )
+
+    def _extract_expected(self, response):
+        """extract es version from docker-compose response"""
+        content = base64.b64decode(response.json()["content"]).decode()
         line = [i for i in content.split("\n") if self.IMAGE in i][0]
-        self.expected = line.split()[-1]
+        return line.split()[-1]
 
     def get_current(self):
         """get current version from docker hub"""
-        response = requests.get(self.TAGS, timeout=10).json()
-        all_tags = [i.get("name") for i in response["results"]]
+        self.current = ConditionalCache().get(
+            self.TAGS, self._extract_current
+        )
+
+    @staticmethod
+    def _extract_current(response):
+        """extract latest version tag from tags response"""
+        all_tags = [i.get("name") for i in response.json()["results"]]
         all_tags.pop(0)
         all_tags.sort()
 
-        self.current = all_tags[-1]
+        return all_tags[-1]
 
     def build_task(self):
         """build task for builder"""
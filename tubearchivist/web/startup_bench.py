@@ -0,0 +1,396 @@
+"""benchmark worker startup of the flask app
+
+Spawns fresh interpreters that import views.py like a uwsgi worker, with
+in memory stand-ins for postgres and redis, and reports import time per
+direct import of views, self import time per package below views, cold
+start to first request latency and RSS per worker.
+
+usage:
+    python startup_bench.py --runs 5
+    python startup_bench.py --max-import-ms 1500 --max-first-request-ms 2000 \
+        --max-rss-mb 120
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+CHILD_FLAG = "--child"
+FIRST_REQUESTS = ["/api/release/latest/", "/"]
+RELEASE_ROW = {
+    "id": 1,
+    "time_stamp": 1700000000,
+    "time_stamp_human": "2023-11-14",
+    "release_version": "v0.4.5",
+    "release_is_latest": True,
+    "breaking_changes": False,
+    "release_notes": "## Changes\n- stand-in release notes",
+}
+
+
+class StandInCursor:
+    """answer release queries with a canned row, everything else empty"""
+
+    def __init__(self):
+        self.rows = []
+        self.rowcount = 0
+        self.closed = False
+
+    def execute(self, query, values=None):
+        """record canned result"""
+        self.rows = [RELEASE_ROW] if "ta_release" in query else []
+        self.rowcount = len(self.rows)
+
+    def fetchall(self):
+        """return canned rows"""
+        return self.rows
+
+    def close(self):
+        """close cursor"""
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StandInConnection:
+    """psycopg2 connection stand-in"""
+
+    closed = 0
+    status = 1
+
+    def cursor(self, cursor_factory=None):
+        """new cursor"""
+        return StandInCursor()
+
+    def commit(self):
+        """nothing to commit"""
+
+    def rollback(self):
+        """nothing to roll back"""
+
+    def close(self):
+        """close connection"""
+        self.closed = 1
+
+
+class StandInPool:
+    """ThreadedConnectionPool stand-in"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def getconn(self):
+        """new connection"""
+        return StandInConnection()
+
+    def putconn(self, conn, close=False):
+        """drop connection"""
+
+
+class StandInPipeline:
+    """collect commands, run them on execute"""
+
+    def __init__(self, redis_conn):
+        self.redis_conn = redis_conn
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        """run queued commands"""
+        return [
+            getattr(self.redis_conn, name)(*args, **kwargs)
+            for name, args, kwargs in self.calls
+        ]
+
+
+class StandInRedis:
+    """in memory redis stand-in covering the commands used at startup"""
+
+    _lock = threading.Lock()
+    _data = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        def unsupported(*args, **kwargs):
+            return None
+
+        return unsupported
+
+    def pipeline(self, transaction=False):
+        """new pipeline"""
+        return StandInPipeline(self)
+
+    def execute_command(self, command, *args):
+        """map raw commands to methods"""
+        return getattr(self, command.lower().replace(".", "_"))(*args)
+
+    def get(self, key):
+        """get value"""
+        with self._lock:
+            value = self._data.get(key)
+
+        return str(value).encode() if value is not None else None
+
+    def set(self, key, value, nx=False, ex=None):
+        """set value"""
+        with self._lock:
+            if nx and key in self._data:
+                return None
+
+            self._data[key] = value
+
+        return True
+
+    def incrby(self, key, amount=1):
+        """increase value"""
+        with self._lock:
+            self._data[key] = int(self._data.get(key, 0)) + amount
+            return self._data[key]
+
+    def incr(self, key):
+        """increase value by one"""
+        return self.incrby(key)
+
+    def delete(self, *keys):
+        """delete keys"""
+        with self._lock:
+            return sum(self._data.pop(i, None) is not None for i in keys)
+
+    def expire(self, key, seconds):
+        """keys never expire"""
+        return key in self._data
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        """set hash fields"""
+        fields = dict(mapping or {})
+        if field is not None:
+            fields[field] = value
+
+        with self._lock:
+            stored = self._data.setdefault(key, {})
+            for name, item in fields.items():
+                if isinstance(item, str):
+                    item = item.encode()
+                elif not isinstance(item, bytes):
+                    item = str(item).encode()
+                stored[name.encode()] = item
+
+        return len(fields)
+
+    def hget(self, key, field):
+        """get hash field"""
+        with self._lock:
+            return self._data.get(key, {}).get(field.encode())
+
+    def hmget(self, key, fields):
+        """get multiple hash fields"""
+        return [self.hget(key, i) for i in fields]
+
+    def hgetall(self, key):
+        """get all hash fields"""
+        with self._lock:
+            return dict(self._data.get(key, {}))
+
+    def register_script(self, script):
+        """scripts do nothing"""
+        return lambda keys=None, args=None: None
+
+    def blmove(self, *args, timeout=0, **kwargs):
+        """empty queue, block like redis"""
+        time.sleep(args[2] if len(args) > 2 else 1)
+
+    def zrangebyscore(self, *args, **kwargs):
+        """sorted sets are always empty"""
+        return []
+
+
+def install_stand_ins():
+    """patch postgres, redis and config before the app is imported"""
+    import psycopg2.pool
+    import redis
+
+    from src import ta_config
+
+    psycopg2.pool.ThreadedConnectionPool = StandInPool
+    redis.Redis = StandInRedis
+    redis.BlockingConnectionPool = StandInPool
+    ta_config.get_config = lambda: {"postgres": {
+        "db_host": "stand-in",
+        "db_database": "archivist",
+        "db_user": "archivist",
+        "db_password": "stand-in",
+    }}
+
+
+def get_rss_mb():
+    """resident set size of this process"""
+    with open("/proc/self/status", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+    return 0
+
+
+def run_child():
+    """act as a single worker, print measurements as json"""
+    spawned = float(os.environ["BENCH_SPAWNED"])
+    install_stand_ins()
+    import_start = time.time()
+    import views
+
+    imported = time.time()
+    client = views.app.test_client()
+    for path in FIRST_REQUESTS:
+        response = client.get(path)
+        if response.status_code >= 400:
+            raise ValueError(f"{path} returned {response.status_code}")
+
+    first_request = time.time()
+    result = {
+        "spawn_to_import_ms": (import_start - spawned) * 1000,
+        "import_views_ms": (imported - import_start) * 1000,
+        "cold_start_to_first_request_ms": (first_request - spawned) * 1000,
+        "rss_mb": get_rss_mb(),
+    }
+    print(json.dumps(result))
+    sys.stdout.flush()
+    os._exit(0)  # skip daemon threads and atexit flush of stand-ins
+
+
+def parse_importtime(stderr, root="views"):
+    """import time in ms of modules loaded while importing root
+
+    Returns cumulative time per direct import of root and self time per
+    package over all levels, src modules are kept apart. Imports of the
+    benchmark itself are outside of root and left out.
+    """
+    subtree = []
+    direct, packages = {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative, name = line.split(":", 1)[1].split("|")
+        depth = (len(name) - len(name.lstrip()) + 1) // 2
+        name = name.strip()
+        if depth > 1:
+            subtree.append((depth, name, int(self_us), int(cumulative)))
+            continue
+
+        if name == root:
+            break
+
+        subtree = []
+    else:
+        subtree = []
+
+    for depth, name, self_us, cumulative in subtree:
+        if depth == 2:
+            direct[name] = cumulative / 1000
+
+        package = name if name.startswith("src.") else name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us / 1000
+
+    return {"direct": direct, "packages": packages}
+
+def run_once():
+    """spawn one worker with import profiling"""
+    env = os.environ.copy()
+    env["BENCH_SPAWNED"] = str(time.time())
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", __file__, CHILD_FLAG],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode:
+        print(result.stderr[-2000:])
+        raise RuntimeError("benchmark worker failed")
+
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    measured["modules"] = parse_importtime(result.stderr)
+    return measured
+
+
+def summarize(runs, top):
+    """median over runs"""
+    summary = {
+        key: statistics.median(i[key] for i in runs)
+        for key in runs[0] if key != "modules"
+    }
+    for kind, key in (
+        ("direct", "views_imports_ms"), ("packages", "slowest_packages_ms")
+    ):
+        names = set().union(*(i["modules"][kind] for i in runs))
+        medians = {
+            name: round(statistics.median(
+                i["modules"][kind].get(name, 0) for i in runs
+            ), 1)
+            for name in names
+        }
+        summary[key] = dict(
+            sorted(medians.items(), key=lambda i: i[1], reverse=True)[:top]
+        )
+
+    return summary
+
+
+def check_thresholds(summary, args):
+    """return list of exceeded thresholds"""
+    limits = [
+        ("import_views_ms", args.max_import_ms),
+        ("cold_start_to_first_request_ms", args.max_first_request_ms),
+        ("rss_mb", args.max_rss_mb),
+    ]
+    return [
+        f"{key} {summary[key]:.1f} > {limit}"
+        for key, limit in limits
+        if limit and summary[key] > limit
+    ]
+
+
+def main():
+    """run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-first-request-ms", type=float)
+    parser.add_argument("--max-rss-mb", type=float)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = summarize(runs, args.top)
+    print(json.dumps(summary, indent=2))
+
+    exceeded = check_thresholds(summary, args)
+    if exceeded:
+        print("startup regression: " + ", ".join(exceeded))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if CHILD_FLAG in sys.argv:
+        run_child()
+    else:
+        main()
@@ -0,0 +1,6 @@
+"""shared test setup, import app modules like a uwsgi worker"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,150 @@
+"""batched version check counter against fakeredis"""
+
+import os
+import threading
+import time
+
+import fakeredis
+import pytest
+import redis
+from src import ta_redis, versioncheck
+from src.versioncheck import VersionCheckCounter
+
+
+@pytest.fixture(name="conn")
+def fixture_conn(monkeypatch):
+    """fresh fakeredis server and empty counter state per test"""
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(
+        ta_redis.RedisPool, "get", lambda *args: fake.connection_pool
+    )
+    monkeypatch.setattr(VersionCheckCounter, "_pending", {})
+    monkeypatch.setattr(VersionCheckCounter, "_pending_count", 0)
+    monkeypatch.setattr(VersionCheckCounter, "_unacked", [])
+    monkeypatch.setattr(VersionCheckCounter, "_flush_event", threading.Event())
+    # flusher is started explicitly where needed
+    monkeypatch.setattr(VersionCheckCounter, "_flusher_pid", os.getpid())
+    return fake
+
+
+def get_total(conn):
+    """sum of all counters in redis"""
+    keys = conn.scan_iter(match=f"{VersionCheckCounter.KEY_BASE}:*")
+    return sum(int(conn.get(i)) for i in keys)
+
+
+def wait_for_total(conn, expected, timeout=5):
+    """poll until background flush wrote expected total"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if get_total(conn) == expected:
+            return True
+        time.sleep(0.01)
+
+    return False
+
+
+def test_threaded_increase(conn, monkeypatch):
+    """concurrent increases with size and timer flushes lose nothing"""
+    monkeypatch.setattr(VersionCheckCounter, "FLUSH_INTERVAL", 0.05)
+    VersionCheckCounter()._start_flusher()
+    threads_count, calls = 8, 500
+
+    def hit():
+        counter = VersionCheckCounter()
+        for _ in range(calls):
+            counter.increase()
+
+    threads = [threading.Thread(target=hit) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    versioncheck.flush_version_counter()
+    assert get_total(conn) == threads_count * calls
+
+
+def test_size_flush_in_background(conn, monkeypatch):
+    """reaching FLUSH_SIZE wakes the flusher, increase never writes"""
+    monkeypatch.setattr(VersionCheckCounter, "FLUSH_INTERVAL", 60)
+    flushed_by = []
+    flush = VersionCheckCounter.flush
+
+    def record_flush(self):
+        flushed_by.append(threading.current_thread().name)
+        flush(self)
+
+    monkeypatch.setattr(VersionCheckCounter, "flush", record_flush)
+    VersionCheckCounter()._start_flusher()
+    counter = VersionCheckCounter()
+    for _ in range(VersionCheckCounter.FLUSH_SIZE):
+        counter.increase()
+
+    assert wait_for_total(conn, VersionCheckCounter.FLUSH_SIZE)
+    assert flushed_by == ["version-counter-flush"]
+
+
+def test_timer_flush(conn, monkeypatch):
+    """counts below FLUSH_SIZE are written after FLUSH_INTERVAL"""
+    monkeypatch.setattr(VersionCheckCounter, "FLUSH_INTERVAL", 0.05)
+    VersionCheckCounter()._start_flusher()
+    counter = VersionCheckCounter()
+    for _ in range(3):
+        counter.increase()
+
+    assert wait_for_total(conn, 3)
+
+
+def test_atexit_flush(conn):
+    """shutdown hook writes remaining counts"""
+    counter = VersionCheckCounter()
+    for _ in range(7):
+        counter.increase()
+
+    assert get_total(conn) == 0
+    versioncheck.flush_version_counter()
+    assert get_total(conn) == 7
+
+
+def test_failed_flush_is_kept(conn, monkeypatch):
+    """counts survive a write that never reached redis"""
+    write_batch = VersionCheckCounter._write_batch
+
+    def fail_write(self, flush_id, counts):
+        raise redis.exceptions.ConnectionError("redis down")
+
+    counter = VersionCheckCounter()
+    for _ in range(5):
+        counter.increase()
+
+    monkeypatch.setattr(VersionCheckCounter, "_write_batch", fail_write)
+    counter.flush()
+    assert get_total(conn) == 0
+
+    counter.increase()
+    monkeypatch.setattr(VersionCheckCounter, "_write_batch", write_batch)
+    counter.flush()
+    assert get_total(conn) == 6
+
+
+def test_lost_reply_not_counted_twice(conn, monkeypatch):
+    """write applied by redis with the reply lost is not repeated"""
+    write_batch = VersionCheckCounter._write_batch
+
+    def lose_reply(self, flush_id, counts):
+        write_batch(self, flush_id, counts)
+        raise redis.exceptions.ConnectionError("reply lost")
+
+    counter = VersionCheckCounter()
+    for _ in range(4):
+        counter.increase()
+
+    monkeypatch.setattr(VersionCheckCounter, "_write_batch", lose_reply)
+    counter.flush()
+    assert get_total(conn) == 4
+
+    monkeypatch.setattr(VersionCheckCounter, "_write_batch", write_batch)
+    counter.flush()
+    assert get_total(conn) == 4
+    assert not VersionCheckCounter._unacked
@@ -1,21 +1,35 @@
 """holds all views and api endpoints"""
 
+from hmac import compare_digest
 from os import environ
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import Flask, render_template, jsonify, request, redirect
-from src.api_docker import run_docker_backup
+from src.api_docker import (
+    run_docker_backup, run_docker_maintenance, run_rollup_check
+)
 from src.dataset import run_chart_recreate
+from src.db import get_pool_stats
+from src.page_cache import PageCache
+from src.release_cache import ReleaseCache
+from src.stats_api import StatsSeries
+from src.hook_worker import HookWorker
+from src.http_client import ConditionalCache, HttpClient
+from src.ta_redis import (
+    BuildHistory, BuildQueue, HookDedup, HookQueue, ScheduledJob, single_run
+)
 from src.versioncheck import VersionCheckCounter, run_version_check_archive
 from src.webhook_docker import DockerHook
 from src.webhook_github import GithubBackup, GithubHook
-import markdown
 
 app = Flask(__name__)
 
+METRICS_TOKEN = environ.get("METRICS_TOKEN")
+HOUR = 60 * 60
+DAY = 24 * HOUR
 scheduler = BackgroundScheduler(timezone=environ.get("TZ"))
 scheduler.add_job(
-    run_docker_backup,
+    single_run("docker_backup", run_docker_backup, HOUR),
     trigger="cron",
     day="*",
     hour="*",
@@ -23,7 +37,7 @@ scheduler.add_job(
     name="docker_backup",
 )
 scheduler.add_job(
-    run_version_check_archive,
+    single_run("version_backup", run_version_check_archive, DAY),
     trigger="cron",
     day="*",
     hour="1",
@@ -31,24 +45,55 @@ scheduler.add_job(
     name="version_backup",
 )
 scheduler.add_job(
-    run_chart_recreate,
+    single_run("chart_recreate", run_chart_recreate, DAY),
     trigger="cron",
     day="*",
     hour="2",
     minute="0",
     name="chart_recreate"
 )
+scheduler.add_job(
+    single_run("docker_maintenance", run_docker_maintenance, DAY),
+    trigger="cron",
+    day="*",
+    hour="3",
+    minute="30",
+    name="docker_maintenance"
+)
+scheduler.add_job(
+    single_run("rollup_check", run_rollup_check, DAY),
+    trigger="cron",
+    day_of_week="sun",
+    hour="3",
+    minute="0",
+    name="rollup_check"
+)
 scheduler.start()
+HookWorker.start()
 
 
 @app.route("/")
 def home():
-    """home page"""
-    latest = GithubBackup("latest").get_tag()
-    latest_notes = markdown.markdown(latest["release_notes"])
-    return render_template(
+    """home page, served from shared page cache"""
+    rendered = PageCache("home").get_rendered(_render_home)
+    return rendered.to_response(request)
+
+
+def _render_home():
+    """render home page, once per release version and worker"""
+    cache = ReleaseCache()
+    page = cache.get("latest", part="home")
+    if page:
+        return page
+
+    backup = GithubBackup("latest")
+    latest = backup.get_tag()
+    latest_notes = backup.get_notes_html()
+    page = render_template(
         'home.html', latest=latest, latest_notes=latest_notes
     )
+    cache.set_part("latest", "home", page)
+    return page
 
 
 @app.route("/discord")
@@ -60,15 +105,80 @@ def discord_redirect():
 
 @app.route("/api/release/<release_id>/")
 def release(release_id):
-    """api release"""
-    result = GithubBackup(release_id).get_tag()
+    """api release, counted by nginx mirror to /api/ping/version/"""
+    rendered = GithubBackup(release_id).get_rendered()
+    return rendered.to_response(request)
+
+
+@app.route("/api/ping/version/")
+def version_ping():
+    """count version check, nginx mirrors every /api/release/ call here"""
     VersionCheckCounter().increase()
+    return "", 204
+
+
+@app.route("/api/stats/pulls/")
+def stats_pulls():
+    """downsampled docker pulls time series"""
+    return _stats_response("pulls")
+
+
+@app.route("/api/stats/versions/")
+def stats_versions():
+    """downsampled version check time series"""
+    return _stats_response("versions")
+
+
+def _stats_response(name):
+    """validate query params and serve cached series"""
+    series = StatsSeries(name, request.args)
+    error = series.validate()
+    if error:
+        return jsonify({"error": error}), 400
+
+    return series.get_rendered().to_response(request)
+
+
+@app.route("/api/builds/")
+def builds():
+    """recent builds with queue wait, clone, build and push times"""
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    limit = min(max(limit, 1), 200)
+    return jsonify(BuildHistory().get_recent(limit))
+
+
+@app.route("/api/metrics/")
+def metrics():
+    """runtime metrics of the worker answering the request"""
+    received = request.headers.get("Authorization", "")
+    expected = f"Bearer {METRICS_TOKEN}"
+    if not METRICS_TOKEN or not compare_digest(received, expected):
+        return "Forbidden", 403
+
+    result = {
+        "db_pool": get_pool_stats(),
+        "release_cache": ReleaseCache().get_stats(),
+        "page_cache": PageCache("home").get_stats(),
+        "hook_queue": HookQueue().get_stats(),
+        "hook_dedup": HookDedup().get_stats(),
+        "build_queue": BuildQueue().get_stats(),
+        "http": HttpClient().get_stats(),
+        "http_cache": ConditionalCache().get_stats(),
+        "scheduler": {
+            i.name: ScheduledJob(i.name, DAY).get_status()
+            for i in scheduler.get_jobs()
+        },
+    }
     return jsonify(result)
 
 
 @app.route("/api/webhook/docker/", methods=['POST'])
 def webhook_docker():
-    """parse docker webhook data"""
+    """validate docker webhook and queue for processing"""
     handler = DockerHook(request)
     valid = handler.validate()
 
@@ -76,25 +186,49 @@ def webhook_docker():
     if not valid:
         return "Forbidden", 403
 
-    print(request.json)
-    message = handler.process()
+    dedup = HookDedup()
+    delivery_id = handler.delivery_id()
+    if dedup.is_duplicate(delivery_id):
+        print("skip duplicate delivery")
+        return jsonify({"success": True, "duplicate": True})
+
+    handler.hook = request.json
+    print(handler.hook)
+    try:
+        job_id = HookQueue().enqueue("docker", handler.hook)
+    except Exception:
+        dedup.forget(delivery_id)
+        raise
+
     handler.save_hook()
 
-    print(message, "hook sent to discord")
-    return jsonify(message)
+    message = {"success": True, "job_id": job_id}
+    return jsonify(message), 202
 
 
 @app.route("/api/webhook/github/", methods=['POST'])
 def webhook_github():
-    """prase webhooks from github"""
+    """validate github webhook and queue for processing"""
     handler = GithubHook(request)
     valid = handler.validate()
     print(f"valid: {valid}")
     if not valid:
         return "Forbidden", 403
 
-    print(request.json)
-    handler.create_hook_task()
+    dedup = HookDedup()
+    delivery_id = handler.delivery_id()
+    if dedup.is_duplicate(delivery_id):
+        print("skip duplicate delivery")
+        return jsonify({"success": True, "duplicate": True})
+
+    handler.hook = request.json
+    print(handler.hook)
+    try:
+        job_id = HookQueue().enqueue("github", handler.hook)
+    except Exception:
+        dedup.forget(delivery_id)
+        raise
+
     handler.save_hook()
-    message = {"success": True}
-    return jsonify(message)
+    message = {"success": True, "job_id": job_id}
+    return jsonify(message), 202